@@ -1,7 +1,10 @@
 import discord
 from discord.ext import commands
 
-from configparser import ConfigParser
+from utils.digest import log_digest
+from utils.config import config
+from utils import database
+
 from datetime import datetime
 import aiohttp
 import logging
@@ -17,15 +20,15 @@ class Toaster(commands.Bot):
         self.log = logging.getLogger("discord")
         self.log.name = ""
 
-        config = ConfigParser()
-        config.read("config.ini")
-
         self.init_time = datetime.now()
         self.token = str(config.get("bot", "token"))
 
     async def setup_hook(self):
         self.session = aiohttp.ClientSession(loop = self.loop)
 
+        # connect to the database (this also creates indexes and starts moving guilds using the old layout)
+        await database.connect()
+
         for cog in ["automod", "custom", "events", "main", "vc"]:
             await self.load_extension(f"cogs.{cog}")
 
@@ -33,7 +36,13 @@ class Toaster(commands.Bot):
         self.log.info("toaster ready")
 
     async def close(self):
+        # send the log entries that are still waiting to be sent
+        await log_digest.close()
+
         await self.session.close()
+        database.close()
+
+        await super().close()
 
     def run(self):
         super().run(self.token, reconnect = True)
@@ -3,24 +3,34 @@ from discord.ext import commands
 
 from utils.base import BaseCog, BaseEmbed
 
-from utils.views import DropdownView, EmojiView, Paginator
-from utils.converters import ValidAction, ValidMethod
-from cogs.events import Events
+from utils.views import DropdownView, EmojiView, LazyPaginator
+from utils.converters import ValidAction, ValidMethod, ValidMode
+from utils.mass import MassAction, VERBS
+from utils.overwrites import overwrite_templates
+from utils.digest import log_digest
+from utils.assets import asset_store
+from cogs.events import Events, CACHE_TTL, MAX_SLOTS, QUARANTINE_FIELDS
 from utils import database
 
 from typing import Optional
+import math
+import time
 
-async def e_or_s_list(ctx, msg, kind, cache = None):
-    """Generates the emoji/sticker cache."""
+# how many cached emojis/stickers are shown per page
+PER_PAGE = 20
+
+async def e_or_s_list(ctx, msg, kind, cache = None, page = 0):
+    """Generates a page of the emoji/sticker cache (newest first)."""
     if cache is None:
         # get cache list from database
         db = database.Guild(ctx.guild)
-        guild = await db.get()
+        guild = await db.get([f'{kind}_cache'])
 
         cache = guild.emoji_cache if kind == 'emoji' else guild.sticker_cache
 
-    # use "add one" / "add all" buttons in message
-    view = EmojiView(msg, ctx, cache, kind)
+        # leave out entries that expired (ones cached before entries had a time don't)
+        cutoff = time.time() - CACHE_TTL
+        cache = [entry for entry in cache if len(entry) < 3 or entry[2] > cutoff]
 
     embed = BaseEmbed()
 
@@ -28,16 +38,32 @@ async def e_or_s_list(ctx, msg, kind, cache = None):
         embed.description = f"No {kind}s are in the cache at the moment."
         return embed, None
 
+    pages = math.ceil(len(cache) / PER_PAGE)
+    page = max(0, min(page, pages - 1))
+
+    # only this page's entries are listed (newest ones are at the end of the cache)
+    start = max(len(cache) - (page + 1) * PER_PAGE, 0)
+    shown = cache[start:len(cache) - page * PER_PAGE][::-1]
+
+    # use "add one" / "add all" buttons in message
+    view = EmojiView(msg, ctx, cache, kind, shown, page, pages)
+
     str_list = []
+    any_saved = False
 
     # list emojis/stickers and their cdn links
-    for entry in cache:
+    for entry in shown:
         name = entry[1]
         url = f"https://cdn.discordapp.com/" + (f"emojis/{entry[0]}" if kind == 'emoji' else f"stickers/{entry[0]}.png")
 
-        str_list.append(f"**[{name}]({url})**")
+        # (* marks the ones that can be restored even if discord deletes them)
+        saved = asset_store.has(kind, entry[0])
+        any_saved = any_saved or saved
+
+        str_list.append(f"**[{name}]({url})**" + ("\\*" if saved else ""))
 
     embed.description = f"**Cached {kind}s:** " + ", ".join(str_list)
+    embed.set_footer(text = f"Page {page + 1}/{pages}" + ("\n*: saved by the bot, can be restored offline" if any_saved else ""))
 
     return embed, view
 
@@ -90,7 +116,7 @@ class Automod(BaseCog):
     @commands.bot_has_permissions(manage_roles = True, kick_members = True, ban_members = True)
     async def quarantine(self, ctx: commands.Context, members: commands.Greedy[discord.Member], action: Optional[ValidAction]):
         db = database.Guild(ctx.guild)
-        guild = await db.get()
+        guild = await db.get(['q_role_id', 'log_id'])
 
         # get quarantine role and users to manage
         # (will be everyone with the quarantine role if no members are given)
@@ -98,6 +124,7 @@ class Automod(BaseCog):
         quarantine = members if members else q_role.members if q_role else None
 
         embed = BaseEmbed()
+        progress = None
 
         if not quarantine:
             embed.description = "Nobody's in quarantine right now."
@@ -117,31 +144,32 @@ class Automod(BaseCog):
 
             return await ctx.send(embed = embed)
 
-        # all of the for statements are separated in case it helps performance, not too sure though
-
-        if action == "clear":
-            for member in quarantine:
-                await member.remove_roles(q_role)
-
-            action_taken = "Cleared"
+        if action in ("clear", "kick", "ban"):
+            # a lot of members might be managed at once, so show the progress while it runs
+            # (the action is saved, so it'll be finished even if the bot restarts)
+            progress = await ctx.send(embed = BaseEmbed(description = f"{VERBS[action][0]} members..."))
+            mass_action = await MassAction.start(ctx.guild, action, [member.id for member in quarantine], q_role, progress)
 
-        elif action == "kick":
-            for member in quarantine:
-                await member.kick()
+            await mass_action.run()
 
-            action_taken = "Kicked"
+            # (the progress message already shows how many were managed)
+            if len(quarantine) > 20:
+                return
 
-        elif action == "ban":
-            for member in quarantine:
-                await member.ban()
+            # list who was managed if there weren't too many
+            action_taken = VERBS[action][1]
+            quarantine = [member for member in quarantine if member.id in mass_action.done]
 
-            action_taken = "Banned"
+            if not quarantine:
+                return
 
         elif not action or action == "add":
             log = await self.client.fetch_channel(guild.log_id)
 
             for member in quarantine:
-                if str(member.id) in guild.quarantine or member.id in guild.queue:
+                position = await Events(self.client).quarantine(member)
+
+                if not position:
                     if len(quarantine) == 1:
                         # send an error if the one member that was listed is being quarantined already
                         return await ctx.send("**Error:** that user is already quarantined!")
@@ -149,8 +177,6 @@ class Automod(BaseCog):
                     # continue in case there are others listed that have not been quarantined yet
                     continue
 
-                position = await Events(self.client).quarantine(member)
-
                 # log the quarantine
                 log_embed = Events(self.client).create_log_embed(
                     title = "Quarantined Member",
@@ -159,18 +185,20 @@ class Automod(BaseCog):
                     extra = position
                 )
 
-                await log.send(embed = log_embed)
+                await log_digest.send(log, log_embed)
 
             action_taken = "Quarantined"
 
         elif action == "queue":
-            if not guild.queue:
+            queue = await db.queue()
+
+            if not queue:
                 embed.description = "The queue is currently empty."
                 return await ctx.send(embed = embed)
 
-            # get a list members in the queue
-            view = Paginator("Quarantine Queue", guild.queue, generate = True)
-            return await ctx.send(embed = view.pages[0], view = view)
+            # list members in the queue (pages are made as they're shown)
+            view = LazyPaginator("Quarantine Queue", queue, lambda user_id: f"<@{user_id}>")
+            return await ctx.send(embed = view.page(0), view = view)
 
         embed.description = f"**{action_taken} {len(quarantine)} member(s):**"
 
@@ -184,13 +212,55 @@ class Automod(BaseCog):
 
         embed.color = discord.Color.brand_green()
 
+        if progress:
+            await progress.edit(embed = embed)
+        else:
+            await ctx.send(embed = embed)
+
+    @commands.command(aliases = ["sl"])
+    @commands.has_permissions(administrator = True)
+    @commands.bot_has_permissions(manage_channels = True, manage_threads = True)
+    async def slots(self, ctx: commands.Context, amount: Optional[int], mode: Optional[ValidMode]):
+        db = database.Guild(ctx.guild)
+        guild = await db.get(['slots', 'quarantined', 'queued', *QUARANTINE_FIELDS])
+
+        embed = BaseEmbed()
+
+        if amount is None and mode is None:
+            # show the current settings
+            embed.description = f"**{guild.quarantined}/{guild.slots}** quarantine {guild.q_mode}s are in use ({guild.queued} queued)."
+            embed.set_footer(text = "Change them with t!slots [amount] [channel/thread]")
+            return await ctx.send(embed = embed)
+
+        mode = mode or guild.q_mode
+        amount = amount or guild.slots
+
+        if not 1 <= amount <= MAX_SLOTS[mode]:
+            embed.description = f"**Error:** there can be 1-{MAX_SLOTS[mode]} quarantine {mode}s at once"
+            return await ctx.send(embed = embed)
+
+        async with db.batch() as batch:
+            batch.set_field('q_slots', amount)
+            batch.set_field('q_mode', mode)
+
+            # make the channel that threads are created in (if it doesn't exist yet)
+            if mode == 'thread' and not ctx.guild.get_channel(guild.q_channel_id):
+                channel = await Events(self.client).make_thread_channel(ctx.guild, guild)
+                batch.set_field('q_channel_id', channel.id)
+
+        embed.description = f"Up to **{amount}** quarantine {mode}s can be open at once."
+        embed.color = discord.Color.brand_green()
+
         await ctx.send(embed = embed)
 
+        # fill any slots that were just added
+        await Events(self.client).promote_queue(ctx.guild)
+
     @commands.command(aliases = ["p"])
     @commands.has_permissions(administrator = True)
     async def priority(self, ctx: commands.Context, channels: commands.Greedy[discord.TextChannel]):
         db = database.Guild(ctx.guild)
-        guild = await db.get()
+        guild = await db.get(['priority'])
 
         added = []
         removed = []
@@ -206,14 +276,15 @@ class Automod(BaseCog):
                 embed.description = "**Prioritized channels:**\n" + ', '.join([f'<#{c}>' for c in guild.priority])
                 embed.set_footer(text = f"{len(guild.priority)} total")
         else:
-            for channel in channels:
-                # add or remove channels depending on if they're in the priority list
-                if channel.id not in guild.priority:
-                    await db.push_to_list('priority', channel.id)
-                    added.append(channel.id)
-                else:
-                    await db.pull_from_list('priority', channel.id)
-                    removed.append(channel.id)
+            async with db.batch() as batch:
+                for channel in channels:
+                    # add or remove channels depending on if they're in the priority list
+                    if channel.id not in guild.priority:
+                        batch.push_to_list('priority', channel.id)
+                        added.append(channel.id)
+                    else:
+                        batch.pull_from_list('priority', channel.id)
+                        removed.append(channel.id)
 
             if added:
                 embed.add_field(name = 'Added:', value = ', '.join([f'<#{c}>' for c in added]))
@@ -227,7 +298,7 @@ class Automod(BaseCog):
     @commands.has_permissions(administrator = True)
     async def allow(self, ctx: commands.Context, roles: commands.Greedy[discord.Role]):
         db = database.Guild(ctx.guild)
-        guild = await db.get()
+        guild = await db.get(['allowed', 'q_channel_id'])
 
         added = []
         removed = []
@@ -243,14 +314,26 @@ class Automod(BaseCog):
                 embed.description = "**Allowed roles:**\n" + ', '.join([f'<@&{r}>' for r in guild.allowed])
                 embed.set_footer(text = f"{len(guild.allowed)} total")
         else:
-            for role in roles:
-                # add or remove channels depending on if they're in the priority list
-                if not guild.allowed or role.id not in guild.allowed:
-                    await db.push_to_list('allowed', role.id)
-                    added.append(role.id)
-                else:
-                    await db.pull_from_list('allowed', role.id)
-                    removed.append(role.id)
+            async with db.batch() as batch:
+                for role in roles:
+                    # add or remove channels depending on if they're in the priority list
+                    if not guild.allowed or role.id not in guild.allowed:
+                        batch.push_to_list('allowed', role.id)
+                        added.append(role.id)
+                    else:
+                        batch.pull_from_list('allowed', role.id)
+                        removed.append(role.id)
+
+            # new quarantine channels use the new list of roles
+            overwrite_templates.forget(ctx.guild.id)
+
+            # allowed roles see quarantine threads by being able to manage them
+            if thread_channel := ctx.guild.get_channel(guild.q_channel_id):
+                for role in roles:
+                    if role.id in added:
+                        await thread_channel.set_permissions(role, view_channel = True, manage_threads = True)
+                    else:
+                        await thread_channel.set_permissions(role, overwrite = None)
 
             if added:
                 embed.add_field(name = 'Added:', value = ', '.join([f'<@&{r}>' for r in added]))
@@ -287,7 +370,7 @@ class Automod(BaseCog):
     @commands.has_permissions(manage_roles = True, kick_members = True, ban_members = True)
     async def lockdown(self, ctx: commands.Context):
         db = database.Guild(ctx.guild)
-        guild = await db.get()
+        guild = await db.get(['lockdown'])
 
         embed = BaseEmbed()
 
@@ -5,15 +5,13 @@ from discord import app_commands
 
 from utils.base import BaseCog, BaseEmbed
 from utils.views import Paginator
+from utils.autocomplete import autocomplete
+from utils.config import config
 from utils import database
 
 from datetime import datetime, timedelta
-from configparser import ConfigParser
 import re
 
-config = ConfigParser()
-config.read("config.ini")
-
 slash_guild = discord.Object(int(config.get("bot", "slash_guild")))
 
 class Custom(BaseCog):
@@ -51,12 +49,9 @@ class Custom(BaseCog):
         await log.send(embed = log_embed)
 
     async def topic_generator(self, interaction: discord.Interaction, current: str) -> list[str]:
-        db = database.Guild(interaction.guild)
-        guild = await db.get()
-
         return [
             app_commands.Choice(name = t, value = t)
-            for t in list(guild.strike_topics.keys()) if current.lower() in t.lower()
+            for t in await autocomplete.topics(interaction.guild, current)
         ]
 
     async def remove_booster_roles(self, member: discord.Member):
@@ -114,7 +109,7 @@ class Custom(BaseCog):
     @commands.has_permissions(administrator = True)
     async def watch(self, ctx: commands.Context, topic: str = None, *, intervals: str = None):
         db = database.Guild(ctx.guild)
-        guild = await db.get()
+        guild = await db.get(['strike_topics'])
 
         embed = BaseEmbed()
 
@@ -142,8 +137,7 @@ class Custom(BaseCog):
 
         # delete the topic if it exists
         elif guild.strike_topics and topic in guild.strike_topics:
-            guild.strike_topics.pop(topic, None)
-            await db.set_field(f'strike_topics', guild.strike_topics)
+            await db.del_field(f'strike_topics.{topic}')
 
             embed.description = f"Removed topic **{topic}**."
 
@@ -171,7 +165,7 @@ class Custom(BaseCog):
     @app_commands.describe(member = "choose a member to check")
     async def user(self, interaction: discord.Interaction, member: discord.Member):
         db = database.Guild(interaction.guild)
-        guild = await db.get()
+        guild = await db.get(['strike_topics'])
 
         user_strikes = []
 
@@ -194,7 +188,7 @@ class Custom(BaseCog):
     @app_commands.autocomplete(topic = topic_generator)
     async def topic(self, interaction: discord.Interaction, topic: str):
         db = database.Guild(interaction.guild)
-        guild = await db.get()
+        guild = await db.get(['strike_topics'])
 
         topic_strikes = []
 
@@ -217,7 +211,7 @@ class Custom(BaseCog):
     @app_commands.default_permissions(kick_members = True, ban_members = True)
     async def unstrike(self, interaction: discord.Interaction, member: discord.Member, topic: str):
         db = database.Guild(interaction.guild)
-        guild = await db.get()
+        guild = await db.get(['strike_topics', 'log_id'])
 
         embed = BaseEmbed()
         t = guild.strike_topics[topic]
@@ -250,7 +244,7 @@ class Custom(BaseCog):
     @app_commands.default_permissions(kick_members = True, ban_members = True)
     async def strike(self, interaction: discord.Interaction, member: discord.Member, topic: str):
         db = database.Guild(interaction.guild)
-        guild = await db.get()
+        guild = await db.get(['strike_topics', 'log_id'])
 
         t = guild.strike_topics[topic]
         intervals: list[str] = t['intervals']
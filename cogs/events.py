@@ -2,13 +2,66 @@ import discord
 from discord.ext import commands
 
 from utils.base import BaseCog, BaseEmbed
-from utils import database
-
-from datetime import datetime, timedelta
+from utils.pipeline import JoinPipeline
+from utils.transcript import channel_logs
+from utils.categories import category_pool
+from utils.overwrites import overwrite_templates
+from utils.digest import log_digest
+from utils.assets import asset_store
+from utils.autocomplete import autocomplete
+from utils.audit import audit_log
+from utils.nuke import detector
+from utils.config import config
+from utils import database, mass
+
+from datetime import datetime
 from typing import Union
-import io
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger("discord")
+
+# the most quarantines that can be open at once in each mode (a guild can have 500 channels,
+# some of which are its own, and 1000 active threads)
+MAX_SLOTS = {'channel': 400, 'thread': 1000}
+
+# deleted emojis/stickers are cached for this long (in seconds), and only the newest ones are kept
+CACHE_SIZE = config.getint("caches", "size", fallback = 50)
+CACHE_TTL = config.getint("caches", "ttl", fallback = 7 * 24 * 60 * 60)
+
+# only the newest incidents are kept (they're stored in the guild's own document)
+MAX_INCIDENTS = config.getint("nuke", "incidents", fallback = 100)
+
+# the fields needed to open a quarantine (see open_quarantine)
+QUARANTINE_FIELDS = ['q_role_id', 'wait_id', 'wait_role_id', 'log_id', 'allowed', 'q_mode', 'q_channel_id', 'q_categories']
 
 class Events(BaseCog):
+    # (only made for the loaded cog, see cog_load)
+    joins: JoinPipeline = None
+
+    # guild id -> lock for making its waiting role (see wait_role)
+    _wait_locks: dict[int, asyncio.Lock] = {}
+
+    async def cog_load(self):
+        # log the messages of open quarantines as they're sent (see on_message)
+        for channel_id in await database.quarantine_channels():
+            channel_logs.track(channel_id)
+
+        # during raids, joins can be queued and handled in batches instead of one at a time
+        if config.getboolean("joins", "queue", fallback = False):
+            self.joins = JoinPipeline(
+                self.handle_joins,
+                batch_size = config.getint("joins", "batch_size", fallback = 50),
+                batch_wait = config.getfloat("joins", "batch_wait", fallback = 0.5),
+                workers = config.getint("joins", "workers", fallback = 2),
+                concurrency = config.getint("joins", "concurrency", fallback = 5)
+            )
+
+    async def cog_unload(self):
+        if self.joins:
+            self.joins.close()
+
     def find_missing(self, before, after):
         """Finds the difference between two lists."""
         if len(before) > len(after):
@@ -37,121 +90,286 @@ class Events(BaseCog):
     async def quarantine(self, member: discord.Member):
         """Quarantines the specified user (or adds them to the queue)."""
         db = database.Guild(member.guild)
-        guild = await db.get()
-
-        q_role = member.guild.get_role(guild.q_role_id)
-
-        if member in q_role.members or member.id in guild.quarantine:
-            return  # do nothing if the user is already being quarantined
-
-        await member.add_roles(q_role)
-        await db.increment()
-
-        # quarantine the user if there are less than 5 active ones (else, add them to the queue)
-        if len(guild.quarantine) < 5:
-            # allow only the member and the bot to view the channel
-            overwrites = {
-                member.guild.default_role: discord.PermissionOverwrite(read_messages = False),
-                member: discord.PermissionOverwrite(
-                    view_channel = True,
-                    attach_files = False,
-                    use_external_emojis = False
-                ),
-                member.guild.me: discord.PermissionOverwrite(view_channel = True)
-            }
-
-            # allow roles in guild.allowed to view quarantine
-            if guild.allowed:
-                for role_id in guild.allowed:
-                    role = member.guild.get_role(role_id)
-                    overwrites[role] = discord.PermissionOverwrite(view_channel = True)
-
-            # hide the waiting room from the member
-            waitroom = member.guild.get_channel(guild.wait_id)
-            await waitroom.set_permissions(member, view_channel = False)
-
-            # get the log channel (to find its category)
-            log = member.guild.get_channel(guild.log_id)
 
-            # create the quarantine channel
-            channel = await member.guild.create_text_channel(f"quarantine-{member.name.replace(' ', '')[0:5]}", overwrites = overwrites, category = log.category)
-            await db.set_field(f'quarantine.{member.id}', channel.id)
+        # take a quarantine slot (or a place in the queue) in one step, so that
+        # joins happening at the same time can't take the same slot
+        guild, position = await db.reserve_quarantine(member.id, QUARANTINE_FIELDS)
 
-            return f"<#{channel.id}>"
-        else:
-            await db.push_to_list('queue', member.id)
-            return f"Queued - #{len(guild.queue) + 1}"
+        if guild is None:
+            return  # do nothing if the user is already being quarantined (or the guild isn't set up)
+
+        if not position:
+            return await self.open_quarantine(member, guild)
+
+        try:
+            q_role = member.guild.get_role(guild.q_role_id)
+            wait_role = await self.wait_role(member.guild, guild)
+
+            # (the waiting role lets them see the waiting room)
+            if roles := [role for role in (q_role, wait_role) if role not in member.roles]:
+                await member.add_roles(*roles, atomic = False)  # (one request for both roles)
+        except Exception:
+            # take the user back out of the queue if they couldn't be given the roles
+            await db.release_quarantine(member.id)
+            raise
 
-    async def remove_quarantine(self, member: discord.Member, reason: str):
-        """Removes a user from quarantine/the queue."""
+        return f"Queued - #{position}"
+
+    async def open_quarantine(self, member: discord.Member, guild: database.Document):
+        """Creates the quarantine channel (or thread) of a user that has a slot reserved."""
         db = database.Guild(member.guild)
-        guild = await db.get()
+        name = f"quarantine-{member.name.replace(' ', '')[0:5]}"
+        category = None
+
+        try:
+            q_role = member.guild.get_role(guild.q_role_id)
+
+            # (guilds set up before the waiting role existed still let the quarantine role see the waiting room, which this fixes)
+            wait_role = await self.wait_role(member.guild, guild)
+
+            if q_role not in member.roles:
+                await member.add_roles(q_role)
+
+            # hide the waiting room from members that were in the queue
+            if wait_role in member.roles:
+                await member.remove_roles(wait_role)
+
+            # (falls back to a channel if the thread channel was deleted)
+            if guild.q_mode == 'thread' and (parent := member.guild.get_channel(guild.q_channel_id)):
+                # private threads can only be seen by the members added to them (and allowed roles, see make_thread_channel)
+                channel = await parent.create_thread(name = name, type = discord.ChannelType.private_thread, invitable = False)
+                await channel.add_user(member)
+            else:
+                # allow only the member, the bot and allowed roles to view the channel
+                overwrites = overwrite_templates.channel(member, guild.allowed)
+
+                # get the log channel (to find its category), then a category with room for the channel
+                log = member.guild.get_channel(guild.log_id)
+                category = await category_pool.acquire(member.guild, log.category, guild.q_categories)
+
+                # create the quarantine channel
+                channel = await member.guild.create_text_channel(name, overwrites = overwrites, category = category)
+
+                if category:
+                    category_pool.created(channel)
+        except Exception:
+            # give the slot back if the quarantine couldn't be made
+            await db.release_quarantine(member.id)
+
+            if category:
+                await category_pool.release(member.guild, category.id)
+
+            raise
+
+        # start logging the channel's messages right away
+        channel_logs.track(channel.id)
+
+        if not await db.start_quarantine(member.id, channel.id):
+            # the quarantine was ended while the channel was being made
+            channel_logs.untrack(channel.id)
+            await channel.delete()  # (its spot is given back by on_guild_channel_delete)
 
-        if guild is None:
             return
 
-        if str(member.id) in guild.quarantine or member.id in guild.queue:
-            # bakcup and delete the quarantine channel if the user was being quarantined (else, remove them from the queue)
-            if str(member.id) in guild.quarantine:
-                what = f"Ended quarantine of {member} ({reason})"
+        return f"<#{channel.id}>"
 
-                channel: discord.TextChannel = await self.client.fetch_channel(guild.quarantine[str(member.id)])
+    async def wait_role(self, guild: discord.Guild, settings: database.Document) -> discord.Role:
+        """Returns the role that lets queued members see the waiting room.
 
-                # backup might take a while
-                saving = BaseEmbed(description = "Saving channel messages... (this might take a while)")
+        Guilds that were set up before it existed get it the first time anyone is quarantined
+        or queued (the quarantine role is then hidden from the waiting room, and everyone
+        queued gets it).
+        """
+        if role := guild.get_role(settings.wait_role_id):
+            return role
 
-                await channel.send(embed = saving)
+        async with self._wait_locks.setdefault(guild.id, asyncio.Lock()):
+            db = database.Guild(guild)
+            settings = await db.get(['wait_role_id', 'wait_id', 'q_role_id'])
 
-                history_log = ''
+            # (another quarantine might've made it while this one was waiting)
+            if role := guild.get_role(settings.wait_role_id):
+                return role
 
-                # iterate over messages in the channel
-                async for message in channel.history(oldest_first = True):
-                    # ignore messages made by the bot
-                    if message.author == message.guild.me:
-                        continue
+            role = await guild.create_role(name = 'waiting', color = 0x200841)
 
-                    # add message to the history log
-                    date = message.created_at.strftime("%m/%d/%Y %H:%M:%S")
-                    msg = (message.content.replace('\n', ' ').replace('  ', ' ') + ' ') if message.content else ''
-                    history_log += f"[{date}] {message.author} > {msg}" + ' '.join(map(str, message.attachments)) + '\n'
+            if waitroom := guild.get_channel(settings.wait_id):
+                await waitroom.set_permissions(role, view_channel = True, send_messages = False)
+                await waitroom.set_permissions(guild.get_role(settings.q_role_id), view_channel = False)
 
-                history: discord.TextChannel = await self.client.fetch_channel(guild.history)
+            await db.set_field('wait_role_id', role.id)
 
-                # send the history log as a text file
-                if history_log != '':
-                    await history.send(file = discord.File(fp = io.BytesIO(history_log.encode("utf8")), filename = f"{member.id}_quarantine.txt"))
+            queue = await db.queue()
 
-                await channel.delete()
-            else:
-                what = f"Removed {member} from the queue ({reason})"
+            for user_id in queue.page(0, len(queue)):
+                if member := guild.get_member(user_id):
+                    await member.add_roles(role)
 
-            # remove the quarantine from the guild's database
-            await db.del_field(f'quarantine.{member.id}')
-            await db.pull_from_list('queue', member.id)
+            return role
 
-            # add an entry to the log channel
-            log = member.guild.get_channel(guild.log_id)
+    async def make_thread_channel(self, guild: discord.Guild, settings: database.Document) -> discord.TextChannel:
+        """Creates the channel that quarantine threads are made in."""
+        q_role = guild.get_role(settings.q_role_id)
 
-            embed = BaseEmbed().set_author(name = what, icon_url = member.display_avatar)
-            await log.send(embed = embed)
+        # quarantined members can only talk in their own thread
+        overwrites = {
+            guild.default_role: discord.PermissionOverwrite(view_channel = False),
+            guild.me: discord.PermissionOverwrite(view_channel = True, manage_threads = True, create_private_threads = True),
+            q_role: discord.PermissionOverwrite(
+                view_channel = True,
+                send_messages = False,
+                send_messages_in_threads = True,
+                create_public_threads = False,
+                create_private_threads = False,
+                attach_files = False,
+                use_external_emojis = False
+            )
+        }
 
-            # if the user was in a quarantine channel, pull in the next person in the queue
-            if str(member.id) in guild.quarantine and len(guild.queue) > 0 and guild.method == 'quarantine':
-                guild = await db.get()
-                next_member = member.guild.get_member(guild.queue[0])
+        # allowed roles can see every private thread (since they can manage them)
+        for role_id in settings.allowed:
+            if role := guild.get_role(role_id):
+                overwrites[role] = discord.PermissionOverwrite(view_channel = True, manage_threads = True)
 
-                await db.pull_from_list('queue', next_member.id)
+        log = guild.get_channel(settings.log_id)
 
-                if (await self.quarantine(next_member)):
-                    embed.set_author(name = f"Moved {next_member} into quarantine #{len(guild.quarantine) + 1}", icon_url = next_member.display_avatar)
-                    embed.color = discord.Color.dark_purple()
+        return await guild.create_text_channel("quarantine", overwrites = overwrites, category = log.category)
 
-                    await log.send(embed = embed)
+    async def promote_queue(self, guild: discord.Guild):
+        """Moves as many users from the queue into quarantine as there are free slots."""
+        db = database.Guild(guild)
+        settings = await db.get(['slots', *QUARANTINE_FIELDS])
+
+        if settings is None:
+            return
+
+        moved = []
+        left = 0
+
+        # (members that left free their slot again, so keep going until the slots are full or the queue is empty)
+        while user_ids := await db.promote(settings.slots):
+            members = []
+
+            for user_id in user_ids:
+                if (member := guild.get_member(user_id)) is None:
+                    await db.release_quarantine(user_id)
+                    left += 1
+                else:
+                    members.append(member)
+
+            # create every channel at the same time
+            channels = await asyncio.gather(*[self.open_quarantine(member, settings) for member in members], return_exceptions = True)
+            failed = False
+
+            for member, channel in zip(members, channels):
+                if isinstance(channel, Exception):
+                    logger.error(f"couldn't move {member.id} into quarantine in {guild.id}", exc_info = channel)
+                    failed = True
+                elif channel:
+                    moved.append((member, channel))
+
+            if failed:
+                break  # (the same thing would most likely happen to everyone else in the queue)
+
+        if not moved and not left:
+            return
+
+        # add a single entry to the log channel for the whole batch
+        embed = BaseEmbed(
+            title = f"Moved {len(moved)} member(s) from the queue into quarantine",
+            description = "\n".join(f"- {member.mention} ({channel})" for member, channel in moved),
+            color = discord.Color.dark_purple()
+        )
+
+        if left:
+            embed.set_footer(text = f"skipped {left} member(s) that left")
+
+        await log_digest.send(guild.get_channel(settings.log_id), embed)
+
+    async def remove_quarantine(self, member: discord.Member, reason: str = None):
+        """Removes a user from quarantine/the queue (if no reason is given, they left and the audit log says how)."""
+        db = database.Guild(member.guild)
+        guild = await db.get(['history', 'log_id', 'method', 'wait_role_id'])
+
+        if guild is None:
+            return
+
+        # remove the quarantine from the guild's database (and free up the slot)
+        entry = await db.release_quarantine(member.id)
+
+        if entry is None:
+            return
+
+        try:
+            # (only looked up now, so members that weren't quarantined don't wait on the audit log)
+            if reason is None and ('channel_id' in entry or 'position' in entry):
+                reason = await self.leave_reason(member)
+
+            # bakcup and delete the quarantine channel if the user was being quarantined (else, they were in the queue)
+            if 'channel_id' in entry:
+                what = f"Ended quarantine of {member} ({reason})"
+
+                channel: Union[discord.TextChannel, discord.Thread] = await self.client.fetch_channel(entry['channel_id'])
+
+                history: discord.TextChannel = await self.client.fetch_channel(guild.history)
+
+                # the channel's messages were logged as they were sent, so only fetch the ones that were missed
+                await channel_logs.backfill(channel)
+
+                # stream the log into a transcript (split into parts if it gets too big to upload)
+                transcript = channel_logs.transcript(
+                    channel.id,
+                    f"{member.id}_quarantine",
+                    max_size = history.guild.filesize_limit,
+                    compress = config.getboolean("transcripts", "compress", fallback = False)
+                )
+
+                try:
+                    # send the transcript as text files (one per message to stay under the upload limit)
+                    for number, file in enumerate(transcript.files()):
+                        await history.send(content = f"**{member}** - {transcript.summary}" if number == 0 else None, file = file)
+                finally:
+                    transcript.close()
+
+                channel_logs.untrack(channel.id)
+
+                if isinstance(channel, discord.Thread):
+                    # (archiving a thread is cheaper than deleting a channel, and the thread channel is kept)
+                    try:
+                        await channel.remove_user(member)
+                    except discord.HTTPException:
+                        pass  # they already left
+
+                    await channel.edit(archived = True, locked = True)
+                else:
+                    await channel.delete()  # (its category spot is given back by on_guild_channel_delete)
+            elif 'position' in entry:
+                what = f"Removed {member} from the queue ({reason})"
+
+                # hide the waiting room from them again
+                if (wait_role := member.guild.get_role(guild.wait_role_id)) in member.roles:
+                    try:
+                        await member.remove_roles(wait_role)
+                    except discord.HTTPException:
+                        pass  # they already left
+            else:
+                return  # the quarantine was still being set up
+
+            # add an entry to the log channel
+            log = member.guild.get_channel(guild.log_id)
+
+            embed = BaseEmbed().set_author(name = what, icon_url = member.display_avatar)
+            await log_digest.send(log, embed)
+        finally:
+            # if the user had a slot (even one that was still being set up), pull in the next people in the queue
+            # (done even if cleaning up failed, e.g. if the channel was already deleted, so the slot isn't left empty)
+            if 'position' not in entry and guild.method == 'quarantine':
+                await self.promote_queue(member.guild)
 
     async def log_action(self, deleted: Union[discord.abc.GuildChannel, discord.Emoji, discord.GuildSticker, discord.Role]):
         """Adds entries for when something is deleted."""
         db = database.Guild(deleted.guild)
-        guild = await db.get()
+        guild = await db.get(['watching_roles', 'watching_channels', 'watching_emojis', 'priority', 'log_id'])
 
         if guild is None:
             return
@@ -168,16 +386,17 @@ class Events(BaseCog):
             return
 
         if isinstance(deleted, (discord.abc.GuildChannel, discord.Role)):
-            # use different caches and audit log entries depending on what was deleted
+            # use different audit log entries depending on what was deleted
             if isinstance(deleted, discord.Role):
-                entry = [e async for e in deleted.guild.audit_logs(action = discord.AuditLogAction.role_delete, limit = 1)][0]
-                cache = guild.role_cache
+                entry = await audit_log.find(deleted.guild, discord.AuditLogAction.role_delete, deleted.id)
                 kind = ["@", "role"]
             else:
-                entry = [e async for e in deleted.guild.audit_logs(action = discord.AuditLogAction.channel_delete, limit = 1)][0]
-                cache = guild.channel_cache
+                entry = await audit_log.find(deleted.guild, discord.AuditLogAction.channel_delete, deleted.id)
                 kind = ["#", "channel"]
 
+            if entry is None or entry.user is None:
+                return  # couldn't find who deleted it
+
             # make the bot ignore itself
             if entry.user == entry.guild.me:
                 return
@@ -187,34 +406,28 @@ class Events(BaseCog):
 
             # if what was deleted was not prioritized, check if other things were deleted as well
             if deleted.id not in guild.priority:
-                now = datetime.now()
-                five_minutes_ago = int((now - timedelta(minutes=5)).timestamp())
+                # (this only touches memory, the database is only written to once it trips)
+                amount_deleted = detector.record(deleted.guild.id, entry.user.id, kind[1], deleted.name)
 
-                # list every deletion entry that happened in the last 5 minutes
-                amount_deleted = [log_entry for log_entry in reversed(cache) if log_entry[0] >= five_minutes_ago and log_entry[1] == entry.user.id]
-
-                # if less than three things were deleted, add it as an entry
-                if len(amount_deleted) < 3:
-                    # clear the cache if it has 10 or more entries in it
-                    if len(cache) >= 10:
-                        await db.clear_list(f'{kind[1]}_cache')
-
-                    entry = [int(now.timestamp()), entry.user.id, deleted.name]
-                    await db.push_to_list(f'{kind[1]}_cache', entry)
-                    return
+                if amount_deleted is None:
+                    return  # not enough was deleted (yet)
 
                 # list what was deleted as the reason
-                reason = f"deleted {kind[1]}s:\n**- {kind[0]}" + f"\n- {kind[0]}".join([log_entry[2] for log_entry in amount_deleted]) + "**"
+                reason = f"deleted {kind[1]}s:\n**- {kind[0]}" + f"\n- {kind[0]}".join(amount_deleted) + "**"
             else:
+                amount_deleted = [deleted.name]
                 reason = f"deleted **{kind[0]}{deleted.name}** (priority)"
 
             # if a bot deleted the channels, kick it and instead get the user that added it
             if entry.user.bot:
                 await entry.user.kick()
 
-                entry = [e async for e in deleted.guild.audit_logs(action=discord.AuditLogAction.bot_add, limit=1)][0]
+                entry = await audit_log.find(deleted.guild, discord.AuditLogAction.bot_add, entry.user.id, fresh = False)
                 reason = "added a bot that " + reason
 
+                if entry is None or entry.user is None:
+                    return  # couldn't find who added the bot
+
             # remove roles from the user that have the following permissions, so that they can't do more harm
             perms_to_remove = [
                 'kick_members',
@@ -227,6 +440,14 @@ class Events(BaseCog):
             roles_to_remove = [role for role in entry.user.roles if any(dict(role.permissions)[perm] for perm in perms_to_remove)]
             await entry.user.remove_roles(*roles_to_remove)
 
+            # keep a record of the incident
+            await db.push_to_list('incidents', {
+                'time': int(datetime.now().timestamp()),
+                'user_id': entry.user.id,
+                'kind': kind[1],
+                'deleted': amount_deleted
+            }, limit = MAX_INCIDENTS)
+
             # log the quarantine
             log = deleted.guild.get_channel(guild.log_id)
             extra = await self.quarantine(entry.user)
@@ -240,19 +461,78 @@ class Events(BaseCog):
             if roles_to_remove:
                 embed.add_field(name = "Took away:", value = ', '.join([f'<@&{r.id}>' for r in roles_to_remove]))
 
-            return await log.send(embed = embed)
+            return await log_digest.send(log, embed)
 
-        # cache emojis and stickers
+        # cache emojis and stickers (and save their images while discord still has them)
         elif isinstance(deleted, discord.Emoji):
-            return await db.push_to_list('emoji_cache', [deleted.id, deleted.name])
+            await self.save_asset(deleted)
+            return await db.push_to_list('emoji_cache', [deleted.id, deleted.name, int(time.time())], limit = CACHE_SIZE)
 
         elif isinstance(deleted, discord.GuildSticker):
-            return await db.push_to_list('sticker_cache', [deleted.id, deleted.name])
+            await self.save_asset(deleted)
+            return await db.push_to_list('sticker_cache', [deleted.id, deleted.name, int(time.time())], limit = CACHE_SIZE)
+
+    async def save_asset(self, item: Union[discord.Emoji, discord.GuildSticker]):
+        """Saves a copy of an emoji/sticker's image, so that it can be restored without discord's cdn."""
+        kind = 'emoji' if isinstance(item, discord.Emoji) else 'sticker'
+
+        if asset_store.has(kind, item.id):
+            return
+
+        try:
+            data = await item.read()
+        except (discord.HTTPException, TypeError):
+            return  # (lottie stickers can't be read this way, they're downloaded when restored instead)
+
+        asset_store.put(kind, item.id, data)
+
+    async def save_new_assets(self, guild: discord.Guild, before: list, after: list):
+        """Saves copies of the emojis/stickers that were just added (if the guild is watching them)."""
+        if not (added := set(after) - set(before)):
+            return
+
+        settings = await database.Guild(guild).get(['watching_emojis'])
+
+        if settings and settings.watching_emojis:
+            for item in added:
+                await self.save_asset(item)
+
+    @commands.Cog.listener()
+    async def on_ready(self):
+        # catch up on messages sent in quarantine channels while the bot was offline
+        for channel_id in channel_logs.channels:
+            if channel := self.client.get_channel(channel_id):
+                await channel_logs.backfill(channel)
+
+        # finish clearing/kicking/banning members if it was interrupted
+        await mass.resume_all(self.client)
+
+    @commands.Cog.listener()
+    async def on_message(self, message: discord.Message):
+        channel_logs.add_message(message)
+
+    @commands.Cog.listener()
+    async def on_raw_message_edit(self, payload: discord.RawMessageUpdateEvent):
+        channel_logs.add_edit(payload)
+
+    @commands.Cog.listener()
+    async def on_raw_message_delete(self, payload: discord.RawMessageDeleteEvent):
+        channel_logs.add_delete(payload)
+
+    @commands.Cog.listener()
+    async def on_audit_log_entry_create(self, entry: discord.AuditLogEntry):
+        # keep recent entries around so that handlers don't have to fetch the audit log
+        audit_log.add(entry)
 
     @commands.Cog.listener()
     async def on_guild_remove(self, guild: discord.Guild):
         # remove the guild from the database if they kick the bot
         await database.Guild(guild).delete()
+        audit_log.forget(guild.id)
+        detector.forget(guild.id)
+        category_pool.forget(guild.id)
+        overwrite_templates.forget(guild.id)
+        autocomplete.forget(guild.id)
 
     @commands.Cog.listener()
     async def on_guild_emojis_update(self, guild, before, after):
@@ -262,6 +542,8 @@ class Events(BaseCog):
 
         if deleted_emoji:
             await self.log_action(deleted_emoji)
+        else:
+            await self.save_new_assets(guild, before, after)
 
     @commands.Cog.listener()
     async def on_guild_stickers_update(self, guild, before, after):
@@ -270,43 +552,69 @@ class Events(BaseCog):
 
         if deleted_sticker:
             await self.log_action(deleted_sticker)
+        else:
+            await self.save_new_assets(guild, before, after)
 
     @commands.Cog.listener()
     async def on_guild_channel_delete(self, channel: discord.abc.GuildChannel):
+        autocomplete.remove_channel(channel)
+        await category_pool.channel_deleted(channel)
         await self.log_action(channel)
 
+    @commands.Cog.listener()
+    async def on_guild_channel_create(self, channel: discord.abc.GuildChannel):
+        # (keeps the quarantine categories' channel counts right, whoever made the channel)
+        category_pool.channel_created(channel)
+
+    @commands.Cog.listener()
+    async def on_guild_channel_update(self, before: discord.abc.GuildChannel, after: discord.abc.GuildChannel):
+        if before.name != after.name:
+            autocomplete.rename(after)
+
+        await category_pool.channel_moved(before, after)
+
     @commands.Cog.listener()
     async def on_guild_role_delete(self, role: discord.Role):
+        overwrite_templates.forget(role.guild.id)
         await self.log_action(role)
 
     @commands.Cog.listener()
-    async def on_member_remove(self, member: discord.Member):
-        # since this event is called multiple times on ban/kick, check what happened first
-        entry = [e async for e in member.guild.audit_logs(limit = 1) if e.target == member][0]
+    async def on_guild_role_update(self, before: discord.Role, after: discord.Role):
+        overwrite_templates.forget(after.guild.id)
 
-        reason = "left"
+    async def leave_reason(self, member: discord.Member) -> str:
+        """Finds out if a member that left was banned or kicked."""
+        # since on_member_remove is called on ban/kick too, check the audit log for what happened
+        entry = await audit_log.find(member.guild, (discord.AuditLogAction.ban, discord.AuditLogAction.kick), member.id)
 
         if entry:
             if entry.action is discord.AuditLogAction.ban:
-                reason = "banned"
+                return "banned"
             elif entry.action is discord.AuditLogAction.kick:
-                reason = "kicked"
+                return "kicked"
 
-        await self.remove_quarantine(member, reason)
+        return "left"
+
+    @commands.Cog.listener()
+    async def on_member_remove(self, member: discord.Member):
+        await self.remove_quarantine(member)
 
     @commands.Cog.listener()
     async def on_member_update(self, before: discord.Member, after: discord.Member):
-        # checks if the quarantine role was given/removed
-        async def is_quarantine(role: discord.Role):
-            guild = await database.Guild(after.guild).get()
+        removed = self.find_missing(before.roles, after.roles)
+        added = self.find_missing(after.roles, before.roles)
 
-            if not guild or not role:
-                return False
+        if not removed and not added:
+            return  # roles didn't change
 
-            return (role.id == guild.q_role_id)
+        guild = await database.Guild(after.guild).get(['q_role_id', 'log_id'])
+
+        if not guild:
+            return
 
-        deleted_role = await is_quarantine(self.find_missing(before.roles, after.roles))
-        added_role = await is_quarantine(self.find_missing(after.roles, before.roles))
+        # checks if the quarantine role was given/removed
+        deleted_role = removed and removed.id == guild.q_role_id
+        added_role = added and added.id == guild.q_role_id
 
         # if quarantine role was removed
         if deleted_role:
@@ -315,10 +623,10 @@ class Events(BaseCog):
         # if quarantine role was added
         elif added_role:
             # get the user that added the role
-            entry = [e async for e in after.guild.audit_logs(action = discord.AuditLogAction.member_role_update, limit = 1) if e.target == after][0]
+            entry = await audit_log.find(after.guild, discord.AuditLogAction.member_role_update, after.id)
 
             # ignore if the role was added by toaster
-            if entry.user == after.guild.me:
+            if entry is None or entry.user == after.guild.me:
                 return
 
             position = await self.quarantine(after)
@@ -333,32 +641,32 @@ class Events(BaseCog):
                 extra = position
             )
 
-            log_id = (await database.Guild(after.guild).get()).log_id
-            log = after.guild.get_channel(log_id)
-
-            await log.send(embed = log_embed)
-
-    @commands.Cog.listener()
-    async def on_member_join(self, member: discord.Member):
-        db = database.Guild(member.guild)
-        guild = await db.get()
-        extra = None
+            log = after.guild.get_channel(guild.log_id)
 
-        if guild is None:
-            return
+            await log_digest.send(log, log_embed)
 
-        # do nothing if the bot was set to ignore new accounts
+    def is_new(self, member: discord.Member, guild: database.Document, now: datetime) -> bool:
+        """Checks if a member that joined should be dealt with (new account or lockdown)."""
         if guild.method == 'ignore':
-            return
+            return False
 
         # get the account's age in seconds
-        account_age = int((datetime.now() - member.created_at.replace(tzinfo = None)).total_seconds())
+        account_age = int((now - member.created_at.replace(tzinfo = None)).total_seconds())
 
-        # do nothing if the account isn't new (and the server isn't on lockdown)
-        if not guild.lockdown and account_age > guild.min_age:
-            return
+        return guild.lockdown or account_age <= guild.min_age
 
+    async def log_join(self, member: discord.Member, guild: database.Document, action: str, extra: str = None):
+        """Logs what was done to a new member."""
         log = member.guild.get_channel(guild.log_id)
+        reason = "Lockdown" if guild.lockdown else None
+
+        embed = self.create_log_embed(f"{action} Member", member, reason, extra)
+
+        await log_digest.send(log, embed)
+
+    async def act_on_join(self, member: discord.Member, guild: database.Document):
+        """Quarantines/kicks/bans a new member depending on the method, then logs it."""
+        extra = None
 
         # manage the account according to the method:
 
@@ -370,20 +678,60 @@ class Events(BaseCog):
 
             action = "Quarantined"
 
-        elif guild.method == 'kick':
-            await member.kick()
-            action = "Kicked"
+        elif guild.method in ('kick', 'ban'):
+            # (retries if discord has trouble with the request)
+            if not await mass.apply(member.guild, guild.method, member.id):
+                return  # already left
 
-        elif guild.method == 'ban':
-            await member.ban()
-            action = "Banned"
+            action = mass.VERBS[guild.method][1]
 
-        reason = "Lockdown" if guild.lockdown else None
+        await self.log_join(member, guild, action, extra)
 
-        # log the action
-        embed = self.create_log_embed(f"{action} Member", member, reason, extra)
+    async def handle_joins(self, members: list[discord.Member]):
+        """Handles a batch of members that joined the same guild (used by the join queue)."""
+        guild = await database.Guild(members[0].guild).get(['method', 'lockdown', 'min_age', 'log_id'])
+
+        if guild is None:
+            return
+
+        # check every account at once, then deal with the new ones a few at a time
+        now = datetime.now()
+        new_members = [member for member in members if self.is_new(member, guild, now)]
+
+        if not new_members:
+            return
+
+        if guild.method in ('kick', 'ban'):
+            # kick/ban the whole batch as one mass action (so that it's resumed if the bot restarts),
+            # sharing the join queue's concurrency limit with every other guild's joins
+            mass_action = await mass.MassAction.start(
+                members[0].guild,
+                guild.method,
+                [member.id for member in new_members],
+                semaphore = self.joins.semaphore
+            )
+            done = set((await mass_action.run()).done)
+
+            action = mass.VERBS[guild.method][1]
+            await self.joins.run_all([self.log_join(member, guild, action) for member in new_members if member.id in done])
+        else:
+            await self.joins.run_all([self.act_on_join(member, guild) for member in new_members])
+
+    @commands.Cog.listener()
+    async def on_member_join(self, member: discord.Member):
+        if self.joins:
+            return self.joins.put(member)
+
+        guild = await database.Guild(member.guild).get(['method', 'lockdown', 'min_age', 'log_id'])
+
+        if guild is None:
+            return
+
+        # do nothing if the bot was set to ignore new accounts, or if the account isn't new (and the server isn't on lockdown)
+        if not self.is_new(member, guild, datetime.now()):
+            return
 
-        await log.send(embed = embed)
+        await self.act_on_join(member, guild)
 
 async def setup(bot: commands.Bot):
     await bot.add_cog(Events(bot))
\ No newline at end of file
@@ -4,6 +4,7 @@ from discord import app_commands
 
 from utils.views import DropdownView, ConfirmView, HelpView
 from utils.base import BaseCog, BaseEmbed
+from utils.autocomplete import autocomplete
 from utils import database
 
 from datetime import datetime, timedelta
@@ -41,18 +42,32 @@ class Main(BaseCog):
             description = "A bot that manages new accounts and helps prevent server nukes.\nUse `t!help` to see a list of commands.",
         )
 
-        guild = await database.Guild(ctx.guild).get()
+        guild = await database.Guild(ctx.guild).get(['quarantined', 'queued', 'actions', 'method'])
 
         # add more information depending on if the guild has been set up
         if guild:
-            quarantined = f"**`{len(guild.quarantine) + len(guild.queue)}` currently** - `{guild.actions}` all time"
+            quarantined = f"**`{guild.quarantined + guild.queued}` currently** - `{guild.actions}` all time"
             method = f"**{guild.method.capitalize()}**"
 
             embed.add_field(name = "Quarantined Users", value = quarantined)
             embed.add_field(name = "Method", value = method)
+
+            # show how backed up the join queue is (if it's enabled)
+            events = self.client.get_cog("Events")
+
+            if events and events.joins:
+                stats = events.joins.stats()
+                latency = f"`{stats['p50'] * 1000:.0f}ms` p50 / `{stats['p99'] * 1000:.0f}ms` p99" if stats['handled'] else "no joins yet"
+
+                embed.add_field(name = "Join Queue", value = f"**`{events.joins.depth(ctx.guild.id)}` waiting** - {latency}")
         else:
             embed.description += "\n**Run `t!setup` to use the quarantine commands.**"
 
+        # show how fast autocompletes are being answered (if any have been)
+        if (stats := autocomplete.stats())['answered']:
+            latency = f"`{stats['p50'] * 1000:.1f}ms` p50 / `{stats['p99'] * 1000:.1f}ms` p99"
+            embed.add_field(name = "Autocomplete", value = f"**`{stats['answered']}` answered** - {latency}")
+
         # get the uptime
         current_time = datetime.now()
         difference = current_time - self.client.init_time
@@ -157,6 +172,9 @@ class Main(BaseCog):
 
         results.append(q_role.id)
 
+        # create the role that lets queued users see the waiting room
+        wait_role = await ctx.message.guild.create_role(name = 'waiting', color = 0x200841)
+
         # used for creating private channels (allow_q -> quarantined people can see it)
         make_private = lambda allow_q: {
             ctx.message.guild.self_role: discord.PermissionOverwrite(view_channel = True),
@@ -170,7 +188,10 @@ class Main(BaseCog):
             description = "If you are seeing this message, many new accounts are joining at this time. Please wait until a moderator is able to see you!",
         )
 
-        waitroom = await ctx.message.guild.create_text_channel(name = 'waiting-room', overwrites = make_private(True))
+        waitroom = await ctx.message.guild.create_text_channel(
+            name = 'waiting-room',
+            overwrites = {**make_private(False), wait_role: discord.PermissionOverwrite(view_channel = True, send_messages = False)}
+        )
         await waitroom.send(embed = wait_embed)
 
         results.append(waitroom.id)
@@ -178,6 +199,7 @@ class Main(BaseCog):
         # create #toaster-history
         history = await ctx.message.guild.create_text_channel(name = 'toaster-history', overwrites = make_private(False))
         results.append(history.id)
+        results.append(wait_role.id)
 
         await db.add_guild(*results)
 
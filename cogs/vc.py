@@ -3,58 +3,53 @@ from discord.ext import commands
 from discord import app_commands
 
 from utils.views import Paginator, ConfirmView
+from utils.autocomplete import autocomplete
 from utils.base import BaseGroupCog
+from utils.config import config
 from utils import database
 
-from configparser import ConfigParser
 import typing
 
-config = ConfigParser()
-config.read("config.ini")
-
 slash_guild = discord.Object(int(config.get("bot", "slash_guild")))
 
 @app_commands.guilds(slash_guild)
 class VC(BaseGroupCog, name = "vc", description = "user-vc commands"):
     async def vc_generator(self, interaction: discord.Interaction, current: str) -> list[str]:
-        db = database.Guild(interaction.guild)
-        guild = await db.get()
-        vcs = {}
-
-        for vc in guild.user_vcs:
-            vc_info = guild.user_vcs.get(vc, {})
-            status = ""
-
-            if interaction.user.id in vc_info.get("waiting", []):
-                status = "🔘"
-            elif interaction.user.id in vc_info.get("accepted", []):
-                status = "✅"
-            elif interaction.user.id in vc_info.get("declined", []):
-                status = "⛔"
-            elif interaction.user.id == vc_info.get("user_id"):
-                status = "👍"
-
-            if channel := interaction.guild.get_channel(int(vc)):
-                vcs[f"{status} {channel.name}".strip()] = str(channel.id)
-
+        # (answered from memory, see utils/autocomplete.py)
         return [
             app_commands.Choice(name = name, value = value)
-            for (name, value) in vcs.items() if current.lower() in name.lower()
+            for (name, value) in await autocomplete.vcs(interaction.guild, interaction.user.id, current)
         ]
 
     async def set_vc_entry(self, db: database.Guild, vc_id: int, user_id: int, successor_id: int = 0):
-        await db.set_field(f"user_vcs.{vc_id}.user_id", user_id)
-        await db.set_field(f"user_vcs.{vc_id}.successor_id", successor_id)
+        vc_prefs = (await db.get(['vc_prefs'])).vc_prefs.get(str(user_id), {})
 
-        vc_prefs = (await db.get()).vc_prefs.get(str(user_id), {})
-        await db.set_field(f"user_vcs.{vc_id}.accepted", vc_prefs.get('trusted', []))
-        await db.set_field(f"user_vcs.{vc_id}.declined", vc_prefs.get('blocked', []))
-        await db.set_field(f"user_vcs.{vc_id}.waiting", [])
+        async with db.batch() as batch:
+            batch.set_field(f"user_vcs.{vc_id}.user_id", user_id)
+            batch.set_field(f"user_vcs.{vc_id}.successor_id", successor_id)
+            batch.set_field(f"user_vcs.{vc_id}.accepted", vc_prefs.get('trusted', []))
+            batch.set_field(f"user_vcs.{vc_id}.declined", vc_prefs.get('blocked', []))
+            batch.set_field(f"user_vcs.{vc_id}.waiting", [])
 
     @commands.Cog.listener()
     async def on_voice_state_update(self, member: discord.Member, before: discord.VoiceState, after: discord.VoiceState):
+        # user vcs only exist in the slash command guild
+        if member.guild.id != slash_guild.id:
+            return
+
+        # ignore mutes/deafens/streams/videos (nothing happens unless someone moves between channels)
+        if (before_id := getattr(before.channel, 'id', None)) == (after_id := getattr(after.channel, 'id', None)):
+            return
+
         db = database.Guild(member.guild)
-        guild = await db.get()
+
+        # ignore channels that aren't user vcs or the creation vc (the index is kept in memory)
+        index = await db.voice_index()
+
+        if before_id not in index and after_id not in index:
+            return
+
+        guild = await db.get(['user_vcs', 'vc_make_id'])
 
         if (
             (vc := before.channel) and
@@ -85,7 +80,7 @@ class VC(BaseGroupCog, name = "vc", description = "user-vc commands"):
     @app_commands.autocomplete(vc = vc_generator)
     async def join(self, interaction: discord.Interaction, vc: str):
         db = database.Guild(interaction.guild)
-        guild = await db.get()
+        guild = await db.get(['user_vcs'])
 
         if not interaction.user.voice:
             return await interaction.response.send_message(f"**Error:** you need to be waiting in a vc", ephemeral = True)
@@ -135,20 +130,18 @@ class VC(BaseGroupCog, name = "vc", description = "user-vc commands"):
             await dm_msg.edit(content = f"**accepted {interaction.user}'s request**", view = None)
             await interaction.edit_original_response(content = f"{waiting_msg} **accepted!**")
             await interaction.user.move_to(vc_channel)
-
-            await db.push_to_list(f"user_vcs.{vc}.accepted", interaction.user.id)
         else:
             await dm_msg.edit(content = f"**declined {interaction.user}'s request**", view = None)
             await interaction.edit_original_response(content = f"{waiting_msg} **declined**")
 
-            await db.push_to_list(f"user_vcs.{vc}.declined", interaction.user.id)
-
-        await db.pull_from_list(f"user_vcs.{vc}.waiting", interaction.user.id)
+        async with db.batch() as batch:
+            batch.push_to_list(f"user_vcs.{vc}.{'accepted' if view.value else 'declined'}", interaction.user.id)
+            batch.pull_from_list(f"user_vcs.{vc}.waiting", interaction.user.id)
 
     @app_commands.command(description = "Get a list of users who can/can't join your vc")
     async def users(self, interaction: discord.Interaction, kind: typing.Literal["trusted", "blocked", "accepted", "declined"]):
         db = database.Guild(interaction.guild)
-        guild = await db.get()
+        guild = await db.get(['vc_prefs', 'user_vcs'])
         users = []
 
         if kind in ("trusted", "blocked"):
@@ -164,7 +157,7 @@ class VC(BaseGroupCog, name = "vc", description = "user-vc commands"):
     @app_commands.command(description = "Trust/untrust someone for your vcs")
     async def trust(self, interaction: discord.Interaction, member: discord.Member):
         db = database.Guild(interaction.guild)
-        guild = await db.get()
+        guild = await db.get(['vc_prefs'])
 
         if member.id == interaction.user.id:
             return await interaction.response.send_message("**Error:** what", ephemeral = True)
@@ -172,8 +165,9 @@ class VC(BaseGroupCog, name = "vc", description = "user-vc commands"):
         trusted_users = guild.vc_prefs.get(str(interaction.user.id), {}).get("trusted", [])
 
         if member.id not in trusted_users:
-            await db.push_to_list(f"vc_prefs.{interaction.user.id}.trusted", member.id)
-            await db.pull_from_list(f"vc_prefs.{interaction.user.id}.blocked", member.id)
+            async with db.batch() as batch:
+                batch.push_to_list(f"vc_prefs.{interaction.user.id}.trusted", member.id)
+                batch.pull_from_list(f"vc_prefs.{interaction.user.id}.blocked", member.id)
 
             await interaction.response.send_message(f"trusted {member.mention} (applies to new vcs)", ephemeral = True)
         else:
@@ -183,7 +177,7 @@ class VC(BaseGroupCog, name = "vc", description = "user-vc commands"):
     @app_commands.command(description = "Block/unblock someone from your vcs")
     async def block(self, interaction: discord.Interaction, member: discord.Member):
         db = database.Guild(interaction.guild)
-        guild = await db.get()
+        guild = await db.get(['vc_prefs'])
 
         if member.id == interaction.user.id:
             return await interaction.response.send_message("**Error:** what", ephemeral = True)
@@ -191,8 +185,9 @@ class VC(BaseGroupCog, name = "vc", description = "user-vc commands"):
         blocked_users = guild.vc_prefs.get(str(interaction.user.id), {}).get("blocked", [])
 
         if member.id not in blocked_users:
-            await db.push_to_list(f"vc_prefs.{interaction.user.id}.blocked", member.id)
-            await db.pull_from_list(f"vc_prefs.{interaction.user.id}.trusted", member.id)
+            async with db.batch() as batch:
+                batch.push_to_list(f"vc_prefs.{interaction.user.id}.blocked", member.id)
+                batch.pull_from_list(f"vc_prefs.{interaction.user.id}.trusted", member.id)
 
             await interaction.response.send_message(f"blocked {member.mention} (applies to new vcs)", ephemeral = True)
         else:
@@ -202,7 +197,7 @@ class VC(BaseGroupCog, name = "vc", description = "user-vc commands"):
     @app_commands.command(description = "Resets the accepted/declined status of the user (for your vc)")
     async def reset(self, interaction: discord.Interaction, member: discord.Member):
         db = database.Guild(interaction.guild)
-        guild = await db.get()
+        guild = await db.get(['user_vcs'])
 
         if member.id == interaction.user.id:
             return await interaction.response.send_message("**Error:** why", ephemeral = True)
@@ -213,15 +208,16 @@ class VC(BaseGroupCog, name = "vc", description = "user-vc commands"):
         ):
             return await interaction.response.send_message(f"**Error:** you're not in a vc owned by you", ephemeral = True)
 
-        await db.pull_from_list(f"user_vcs.{vc}.accepted", member.id)
-        await db.pull_from_list(f"user_vcs.{vc}.declined", member.id)
+        async with db.batch() as batch:
+            batch.pull_from_list(f"user_vcs.{vc}.accepted", member.id)
+            batch.pull_from_list(f"user_vcs.{vc}.declined", member.id)
 
         await interaction.response.send_message(f"reset {member.mention}'s join status", ephemeral = True)
 
     @app_commands.command(description = "Transfer ownership of your vc (when you leave)")
     async def successor(self, interaction: discord.Interaction, member: discord.Member):
         db = database.Guild(interaction.guild)
-        guild = await db.get()
+        guild = await db.get(['user_vcs'])
 
         if member.id == interaction.user.id:
             return await interaction.response.send_message(f"**Error:** you can't make yourself a successor", ephemeral = True)
@@ -243,7 +239,7 @@ class VC(BaseGroupCog, name = "vc", description = "user-vc commands"):
     @app_commands.command(description = "Transfer ownership of your vc (now)")
     async def transfer(self, interaction: discord.Interaction, member: discord.Member):
         db = database.Guild(interaction.guild)
-        guild = await db.get()
+        guild = await db.get(['user_vcs'])
 
         if member.id == interaction.user.id:
             return await interaction.response.send_message(f"**Error:** you can't transfer a vc to yourself", ephemeral = True)
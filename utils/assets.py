@@ -0,0 +1,109 @@
+from utils.config import config
+
+from collections import OrderedDict
+from pathlib import Path
+from typing import Union
+import hashlib
+import os
+
+class AssetStore:
+    """Keeps copies of emoji/sticker images on disk, so they can be restored after discord stops serving them.
+
+    Images are stored once per sha256 hash (blobs/<hash>), with small ref files
+    (refs/<kind>-<id>) pointing at them. When the blobs take up more than max_size bytes,
+    the least recently used ones are deleted.
+    """
+    def __init__(self, directory: str, max_size: int):
+        self.directory = Path(directory)
+        self.max_size = max_size
+
+        # hash -> size, least recently used first
+        self._blobs: Union[OrderedDict[str, int], None] = None
+        self._refs: dict[str, str] = {}
+        self._size = 0
+
+    def _blob_path(self, digest: str) -> Path:
+        return self.directory / "blobs" / digest
+
+    def _load(self) -> None:
+        if self._blobs is not None:
+            return
+
+        (self.directory / "blobs").mkdir(parents = True, exist_ok = True)
+        (self.directory / "refs").mkdir(parents = True, exist_ok = True)
+
+        # (files are touched whenever they're used, so their mtime is when they were last used)
+        blobs = sorted((path.stat().st_mtime, path.name, path.stat().st_size) for path in (self.directory / "blobs").iterdir())
+
+        self._blobs = OrderedDict((digest, size) for _, digest, size in blobs)
+        self._size = sum(self._blobs.values())
+
+        for path in (self.directory / "refs").iterdir():
+            self._refs[path.name] = path.read_text()
+
+    def has(self, kind: str, item_id: int) -> bool:
+        """Checks if an emoji/sticker's image is stored."""
+        self._load()
+        return self._refs.get(f"{kind}-{item_id}") in self._blobs
+
+    def put(self, kind: str, item_id: int, data: bytes) -> None:
+        """Stores an emoji/sticker's image (images that are already stored aren't written again)."""
+        self._load()
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._blob_path(digest)
+
+        if digest in self._blobs:
+            self._blobs.move_to_end(digest)
+            os.utime(path)
+        else:
+            # (written under another name first, so a half-written file is never used)
+            temp = path.with_suffix(".tmp")
+            temp.write_bytes(data)
+            os.replace(temp, path)
+
+            self._blobs[digest] = len(data)
+            self._size += len(data)
+
+        key = f"{kind}-{item_id}"
+
+        if self._refs.get(key) != digest:
+            (self.directory / "refs" / key).write_text(digest)
+            self._refs[key] = digest
+
+        self._evict()
+
+    def _evict(self) -> None:
+        # (the newest blob is always kept, even if it's bigger than max_size on its own)
+        while self._size > self.max_size and len(self._blobs) > 1:
+            digest, size = self._blobs.popitem(last = False)
+            self._size -= size
+            self._blob_path(digest).unlink(missing_ok = True)
+
+    def read(self, kind: str, item_id: int) -> Union[bytes, None]:
+        """Returns a stored emoji/sticker's image (None if it isn't stored)."""
+        if not self.has(kind, item_id):
+            return None
+
+        digest = self._refs[f"{kind}-{item_id}"]
+        path = self._blob_path(digest)
+
+        try:
+            # (discord.py needs the image as bytes to upload it, so it's read in one go)
+            data = path.read_bytes()
+        except FileNotFoundError:
+            data = b''
+
+        if not data:
+            # the file is missing (or empty), so forget about it
+            self._size -= self._blobs.pop(digest, 0)
+            return None
+
+        self._blobs.move_to_end(digest)
+        os.utime(path)
+
+        return data
+
+asset_store = AssetStore(
+    config.get("assets", "directory", fallback = "assets"),
+    max_size = config.getint("assets", "max_size", fallback = 100) * 1024 * 1024
+)
@@ -0,0 +1,137 @@
+import discord
+
+from utils.config import config
+
+from collections import deque
+from typing import Union
+import asyncio
+
+def _target_id(entry: discord.AuditLogEntry) -> Union[int, None]:
+    return getattr(entry.target, 'id', None)
+
+class AuditLog:
+    """Keeps each guild's latest audit log entries (sent over the gateway), indexed by (action, target id).
+
+    This lets handlers find out who did something without fetching the audit log
+    over REST, which is rate limited (and gets hit the hardest during nukes).
+    """
+    def __init__(self, size: int, wait: float, max_age: float):
+        self.size = size
+        self.wait = wait
+        self.max_age = max_age
+
+        self._entries: dict[int, deque[discord.AuditLogEntry]] = {}
+        self._index: dict[int, dict[tuple, discord.AuditLogEntry]] = {}
+        self._waiters: dict[tuple, list[asyncio.Future]] = {}
+
+        self.hits = 0
+        self.misses = 0
+
+    def add(self, entry: discord.AuditLogEntry) -> None:
+        """Stores an entry (dropping the guild's oldest one if its buffer is full)."""
+        guild_id = entry.guild.id
+        entries = self._entries.setdefault(guild_id, deque())
+        index = self._index.setdefault(guild_id, {})
+
+        if len(entries) >= self.size:
+            oldest = entries.popleft()
+            key = (oldest.action, _target_id(oldest))
+
+            if index.get(key) is oldest:
+                del index[key]
+
+        key = (entry.action, _target_id(entry))
+
+        entries.append(entry)
+        index[key] = entry
+
+        # wake up anything waiting for this entry
+        for future in self._waiters.pop((guild_id, *key), []):
+            if not future.done():
+                future.set_result(entry)
+
+    def _recent(self, guild_id: int, actions: tuple, target_id: int, fresh: bool) -> Union[discord.AuditLogEntry, None]:
+        """Returns the newest stored entry matching any of the actions (None if there isn't one)."""
+        index = self._index.get(guild_id, {})
+        now = discord.utils.utcnow()
+
+        found = [
+            entry for action in actions
+            if (entry := index.get((action, target_id)))
+            and (not fresh or (now - entry.created_at).total_seconds() <= self.max_age)
+        ]
+
+        return max(found, key = lambda entry: entry.id, default = None)
+
+    async def _wait_for(self, guild_id: int, actions: tuple, target_id: int) -> Union[discord.AuditLogEntry, None]:
+        """Waits (up to self.wait seconds) for a matching entry to be added."""
+        futures = []
+
+        for action in actions:
+            future = asyncio.get_running_loop().create_future()
+            self._waiters.setdefault((guild_id, action, target_id), []).append(future)
+            futures.append(future)
+
+        try:
+            done, _ = await asyncio.wait(futures, timeout = self.wait, return_when = asyncio.FIRST_COMPLETED)
+        finally:
+            for action, future in zip(actions, futures):
+                waiters = self._waiters.get(key := (guild_id, action, target_id), [])
+
+                if future in waiters:
+                    waiters.remove(future)
+
+                if not waiters:
+                    self._waiters.pop(key, None)
+
+        return done.pop().result() if done else None
+
+    async def find(
+        self,
+        guild: discord.Guild,
+        actions: Union[discord.AuditLogAction, tuple[discord.AuditLogAction, ...]],
+        target_id: int,
+        fresh: bool = True
+    ) -> Union[discord.AuditLogEntry, None]:
+        """Finds the entry for something done to target_id.
+
+        If it hasn't arrived yet, this waits for it for a bit, then falls back to fetching
+        the audit log. Only entries from the last max_age seconds are used if fresh is True.
+        """
+        # (discord.py's enum values are tuples themselves, so check for the enum instead)
+        if isinstance(actions, discord.AuditLogAction):
+            actions = (actions,)
+
+        if entry := self._recent(guild.id, actions, target_id, fresh):
+            self.hits += 1
+            return entry
+
+        # the audit log event is usually sent a little after the event it's about
+        # (only new entries are worth waiting for, old ones won't be sent again)
+        if fresh and (entry := await self._wait_for(guild.id, actions, target_id)):
+            self.hits += 1
+            return entry
+
+        self.misses += 1
+
+        # fall back to fetching the audit log
+        try:
+            async for entry in guild.audit_logs(limit = 10, action = actions[0] if len(actions) == 1 else None):
+                if fresh and (discord.utils.utcnow() - entry.created_at).total_seconds() > self.max_age:
+                    break  # (entries are newest first)
+
+                if entry.action in actions and _target_id(entry) == target_id:
+                    return entry
+        except discord.Forbidden:
+            pass
+
+    def forget(self, guild_id: int) -> None:
+        """Drops everything stored for a guild."""
+        self._entries.pop(guild_id, None)
+        self._index.pop(guild_id, None)
+
+audit_log = AuditLog(
+    size = config.getint("audit", "size", fallback = 100),
+    wait = config.getfloat("audit", "wait", fallback = 1.5),
+    max_age = config.getfloat("audit", "max_age", fallback = 30)
+)
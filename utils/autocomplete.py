@@ -0,0 +1,259 @@
+import discord
+
+from utils import database
+
+from collections import deque
+from typing import Union
+import bisect
+import time
+
+# discord shows at most 25 choices
+_MAX_CHOICES = 25
+
+# how a user's relation to a vc is shown (the first one that applies is used)
+_STATUSES = (('waiting', "🔘"), ('accepted', "✅"), ('declined', "⛔"), ('owner', "👍"))
+
+def _ids(value) -> list[int]:
+    """Returns the ids in a $push/$pull value."""
+    if isinstance(value, dict):
+        return value.get('$each', value.get('$in', []))
+
+    return [value]
+
+class _VCs:
+    """A guild's user vcs, with each user's status in every vc they have one in.
+
+    The vcs' channel names are kept sorted as (lowercase name, name, vc id), so they
+    can be searched with bisect.
+    """
+    __slots__ = ('guild', 'members', 'statuses', 'names', '_named')
+
+    def __init__(self, guild: discord.Guild, user_vcs: dict):
+        self.guild = guild
+
+        # vc id -> {'owner': {user id}, 'waiting': {...}, 'accepted': {...}, 'declined': {...}}
+        self.members: dict[int, dict[str, set[int]]] = {}
+
+        # user id -> vc id -> status
+        self.statuses: dict[int, dict[int, str]] = {}
+
+        # (lowercase name, name, vc id), sorted, and each vc's entry in it
+        self.names: list[tuple[str, str, int]] = []
+        self._named: dict[int, tuple[str, str, int]] = {}
+
+        for vc_id, info in user_vcs.items():
+            self.set_vc(int(vc_id), info)
+
+    def _index(self, vc_id: int) -> None:
+        if vc_id not in self._named and (channel := self.guild.get_channel(vc_id)):
+            entry = self._named[vc_id] = (channel.name.lower(), channel.name, vc_id)
+            bisect.insort(self.names, entry)
+
+    def unindex(self, vc_id: int) -> None:
+        """Removes a vc's name from the index (when its channel is deleted or renamed)."""
+        if (entry := self._named.pop(vc_id, None)) is not None:
+            del self.names[bisect.bisect_left(self.names, entry)]
+
+    def rename(self, vc_id: int) -> None:
+        """Updates a vc's name in the index (with its channel's current name)."""
+        if vc_id in self.members:
+            self.unindex(vc_id)
+            self._index(vc_id)
+
+    def _refresh(self, vc_id: int, user_ids) -> None:
+        members = self.members.get(vc_id)
+
+        for user_id in user_ids:
+            status = next((symbol for kind, symbol in _STATUSES if members and user_id in members[kind]), None)
+            statuses = self.statuses.setdefault(user_id, {})
+
+            if status is None:
+                statuses.pop(vc_id, None)
+            else:
+                statuses[vc_id] = status
+
+            if not statuses:
+                del self.statuses[user_id]
+
+    def _everyone(self, vc_id: int) -> set[int]:
+        return set().union(*self.members.get(vc_id, {}).values())
+
+    def set_vc(self, vc_id: int, info: dict) -> None:
+        before = self._everyone(vc_id)
+
+        self.members[vc_id] = {kind: set(info.get(kind, [])) for kind, _ in _STATUSES[:3]}
+        self.members[vc_id]['owner'] = {info['user_id']} if info.get('user_id') else set()
+
+        self._index(vc_id)
+        self._refresh(vc_id, before | self._everyone(vc_id))
+
+    def remove_vc(self, vc_id: int) -> None:
+        before = self._everyone(vc_id)
+        self.members.pop(vc_id, None)
+
+        self.unindex(vc_id)
+        self._refresh(vc_id, before)
+
+    def change(self, vc_id: int, kind: str, operator: str, value) -> None:
+        members = self.members.setdefault(vc_id, {kind: set() for kind, _ in _STATUSES})
+        users = members[kind]
+        before = set(users)
+
+        if operator == '$set':
+            users.clear()
+
+            if kind != 'owner':
+                users.update(value)
+            elif value:
+                users.add(value)
+        elif operator == '$unset':
+            users.clear()
+        elif operator == '$push':
+            users.update(_ids(value))
+        elif operator == '$pull':
+            users.difference_update(_ids(value))
+
+        self._index(vc_id)
+        self._refresh(vc_id, before | users)
+
+class Autocomplete:
+    """Answers the vc and strike topic autocompletes from memory.
+
+    Each guild's topics and user vcs are loaded the first time they're needed and then
+    kept up to date with every write to the guild (see apply) and with channel renames/deletes,
+    so typing in an autocomplete field doesn't read the database or sort anything.
+    """
+    def __init__(self):
+        # guild id -> (lowercase topic, topic), sorted
+        self._topics: dict[int, list[tuple[str, str]]] = {}
+        self._vcs: dict[int, _VCs] = {}
+
+        # how long the latest answers took (in seconds)
+        self.latencies: deque[float] = deque(maxlen = 1000)
+
+    def apply(self, guild_id: int, update: dict) -> None:
+        """Applies an update (made for a guild's document) to the guild's indexes."""
+        topics = self._topics.get(guild_id)
+        vcs = self._vcs.get(guild_id)
+
+        for operator, fields in update.items():
+            for path, value in fields.items():
+                root, *rest = path.split('.')
+
+                if root == 'strike_topics' and topics is not None and len(rest) <= 1:
+                    names = [rest[0]] if rest else [name for _, name in topics]
+
+                    for name in names:
+                        if (index := bisect.bisect_left(topics, (name.lower(), name))) < len(topics) and topics[index][1] == name:
+                            topics.pop(index)
+
+                    if operator == '$set':
+                        for name in ([rest[0]] if rest else value):
+                            bisect.insort(topics, (name.lower(), name))
+
+                elif root == 'user_vcs' and vcs is not None:
+                    if not rest:
+                        self._vcs[guild_id] = vcs = _VCs(vcs.guild, value if operator == '$set' else {})
+                    elif len(rest) == 1 and operator == '$set':
+                        vcs.set_vc(int(rest[0]), value)
+                    elif len(rest) == 1:
+                        vcs.remove_vc(int(rest[0]))
+                    elif rest[1] in ('waiting', 'accepted', 'declined', 'user_id'):
+                        vcs.change(int(rest[0]), 'owner' if rest[1] == 'user_id' else rest[1], operator, value)
+
+    def forget(self, guild_id: int) -> None:
+        """Drops a guild's indexes."""
+        self._topics.pop(guild_id, None)
+        self._vcs.pop(guild_id, None)
+
+    def rename(self, channel: discord.abc.GuildChannel) -> None:
+        """Picks up a channel's new name (if it's a user vc)."""
+        if vcs := self._vcs.get(channel.guild.id):
+            vcs.rename(channel.id)
+
+    def remove_channel(self, channel: discord.abc.GuildChannel) -> None:
+        """Stops suggesting a deleted channel (if it was a user vc)."""
+        if vcs := self._vcs.get(channel.guild.id):
+            vcs.unindex(channel.id)
+
+    def _match(self, entries: list[tuple], current: str) -> list:
+        """Returns the entries whose names start with current, then the ones containing it.
+
+        Entries are (lowercase name, ...) tuples sorted by name, and are returned as they are.
+        """
+        current = current.lower()
+        start = bisect.bisect_left(entries, (current,))
+
+        matches = []
+
+        # the names starting with current are next to each other
+        for entry in entries[start:]:
+            if not entry[0].startswith(current) or len(matches) == _MAX_CHOICES:
+                break
+
+            matches.append(entry)
+
+        if len(matches) < _MAX_CHOICES and current:
+            for entry in entries[:start] + entries[start + len(matches):]:
+                if current in entry[0]:
+                    matches.append(entry)
+
+                    if len(matches) == _MAX_CHOICES:
+                        break
+
+        return matches
+
+    async def topics(self, guild: discord.Guild, current: str) -> list[str]:
+        """Returns the guild's strike topics that match what's been typed."""
+        started = time.perf_counter()
+
+        if (topics := self._topics.get(guild.id)) is None:
+            document = await database.Guild(guild).get(['strike_topics'])
+            topics = self._topics.setdefault(guild.id, sorted((name.lower(), name) for name in (document.strike_topics if document else {})))
+
+        matches = [name for _, name in self._match(topics, current)]
+
+        self.latencies.append(time.perf_counter() - started)
+        return matches
+
+    async def vcs(self, guild: discord.Guild, user_id: int, current: str) -> list[tuple[str, str]]:
+        """Returns (name, channel id) for the guild's user vcs that match what's been typed.
+
+        Names start with the user's status in the vc (waiting, accepted, declined or owner).
+        """
+        started = time.perf_counter()
+
+        if (vcs := self._vcs.get(guild.id)) is None:
+            document = await database.Guild(guild).get(['user_vcs'])
+            vcs = self._vcs.setdefault(guild.id, _VCs(guild, document.user_vcs if document else {}))
+
+        statuses = self.statuses(guild.id, user_id)
+
+        matches = [
+            (f"{statuses.get(vc_id, '')} {name}".strip(), str(vc_id))
+            for _, name, vc_id in self._match(vcs.names, current)
+        ]
+
+        self.latencies.append(time.perf_counter() - started)
+        return matches
+
+    def statuses(self, guild_id: int, user_id: int) -> dict[int, str]:
+        """Returns a user's status in each of the guild's vcs (vc id -> status)."""
+        vcs = self._vcs.get(guild_id)
+        return vcs.statuses.get(user_id, {}) if vcs else {}
+
+    def stats(self) -> dict[str, Union[float, int, None]]:
+        """Returns how many answers were timed and the p50/p99 latency (in seconds)."""
+        latencies = sorted(self.latencies)
+
+        def percentile(p: float):
+            return latencies[min(len(latencies) - 1, int(len(latencies) * p))] if latencies else None
+
+        return {
+            'answered': len(latencies),
+            'p50': percentile(0.5),
+            'p99': percentile(0.99)
+        }
+
+autocomplete = Autocomplete()
+database.on_write(autocomplete.apply)
@@ -0,0 +1,200 @@
+import discord
+
+from utils import database
+
+from typing import Union
+import asyncio
+
+# how many channels discord lets a category hold
+CATEGORY_LIMIT = 50
+
+class CategoryPool:
+    """Spreads quarantine channels over as many categories as they need.
+
+    Channels go in the log channel's category until it's full, then into overflow
+    categories that are made when needed and deleted once they're empty. Channel counts
+    are read from discord's cache once per guild and then kept up to date with the guild's
+    channel events (see channel_created/channel_deleted, which also count channels made by
+    anyone else), so picking a category doesn't have to look at the guild's channels.
+    """
+    def __init__(self, limit: int = CATEGORY_LIMIT):
+        self.limit = limit
+
+        # guild id -> category id -> channels in it (including ones that are being made)
+        self._counts: dict[int, dict[int, int]] = {}
+
+        # guild id -> categories that still have room (the last one is used first)
+        self._open: dict[int, list[int]] = {}
+
+        # guild id -> ids of the overflow categories
+        self._overflow: dict[int, set[int]] = {}
+        self._locks: dict[int, asyncio.Lock] = {}
+
+        # channels made through acquire (counted by their spot), and channels counted by their create event
+        # (a channel's event can come before or after the request that made it returns, see created)
+        self._made: set[int] = set()
+        self._counted: set[int] = set()
+
+    def _adjust(self, guild_id: int, category_id: int, change: int) -> None:
+        """Changes a category's count, opening/closing it as it goes under/over the limit."""
+        counts = self._counts[guild_id]
+        was_open = counts[category_id] < self.limit
+
+        counts[category_id] = max(counts[category_id] + change, 0)
+
+        if was_open and counts[category_id] >= self.limit:
+            self._open[guild_id].remove(category_id)
+        elif not was_open and counts[category_id] < self.limit:
+            self._open[guild_id].append(category_id)
+
+    def _count(self, guild: discord.Guild, category_id: int) -> None:
+        category = guild.get_channel(category_id)
+        count = len(category.channels) if category else self.limit
+
+        self._counts[guild.id][category_id] = count
+
+        if count < self.limit:
+            self._open[guild.id].append(category_id)
+
+    async def _load(self, guild: discord.Guild, base: discord.CategoryChannel, overflow: list[int]) -> None:
+        self._counts[guild.id] = {}
+        self._open[guild.id] = []
+        self._overflow[guild.id] = set()
+
+        self._count(guild, base.id)
+
+        for category_id in overflow:
+            if guild.get_channel(category_id) is None:
+                await database.Guild(guild).pull_from_list('q_categories', category_id)
+                continue
+
+            self._overflow[guild.id].add(category_id)
+            self._count(guild, category_id)
+
+            # (clean up categories that were left empty while the bot was offline)
+            await self._collect(guild, category_id)
+
+    async def acquire(self, guild: discord.Guild, base: Union[discord.CategoryChannel, None], overflow: list[int]) -> Union[discord.CategoryChannel, None]:
+        """Takes a spot for a new quarantine channel, returning the category to make it in.
+
+        base is the log channel's category and overflow is the guild's q_categories. The spot
+        has to be given back with release if the channel is deleted (or couldn't be made).
+        """
+        if base is None:
+            return None  # (channels outside of categories don't have a limit to work around)
+
+        lock = self._locks.setdefault(guild.id, asyncio.Lock())
+
+        if guild.id not in self._counts:
+            async with lock:
+                if guild.id not in self._counts:
+                    await self._load(guild, base, overflow)
+
+        open_categories = self._open[guild.id]
+
+        if not open_categories:
+            async with lock:
+                # (another quarantine might've made a category while this one was waiting)
+                if not open_categories:
+                    await self._create(guild, base)
+
+        category_id = open_categories[-1]
+        self._adjust(guild.id, category_id, 1)
+
+        return guild.get_channel(category_id)
+
+    def created(self, channel: discord.abc.GuildChannel) -> None:
+        """Marks an acquired spot as taken by the channel made in it (call it once the channel is made)."""
+        if channel.id in self._counted:
+            # its create event already counted it, so the spot isn't needed anymore
+            self._counted.discard(channel.id)
+            self._adjust(channel.guild.id, channel.category_id, -1)
+        else:
+            self._made.add(channel.id)
+
+    def channel_created(self, channel: discord.abc.GuildChannel) -> None:
+        """Counts a new channel (from on_guild_channel_create) if it's in one of the pool's categories."""
+        if channel.category_id not in self._counts.get(channel.guild.id, {}):
+            return
+
+        if channel.id in self._made:
+            self._made.discard(channel.id)  # (already counted by its spot)
+        else:
+            self._counted.add(channel.id)
+            self._adjust(channel.guild.id, channel.category_id, 1)
+
+    async def channel_deleted(self, channel: discord.abc.GuildChannel) -> None:
+        """Stops counting a deleted channel (from on_guild_channel_delete), deleting its category if it was an empty overflow one."""
+        self._made.discard(channel.id)
+        self._counted.discard(channel.id)
+
+        if channel.category_id not in self._counts.get(channel.guild.id, {}):
+            return
+
+        self._adjust(channel.guild.id, channel.category_id, -1)
+        await self._collect(channel.guild, channel.category_id)
+
+    async def channel_moved(self, before: discord.abc.GuildChannel, after: discord.abc.GuildChannel) -> None:
+        """Moves a channel's count to its new category (from on_guild_channel_update)."""
+        if before.category_id != after.category_id:
+            await self.channel_deleted(before)
+            self.channel_created(after)
+
+    async def _create(self, guild: discord.Guild, base: discord.CategoryChannel) -> None:
+        overwrites = {
+            guild.default_role: discord.PermissionOverwrite(view_channel = False),
+            guild.me: discord.PermissionOverwrite(view_channel = True, manage_channels = True)
+        }
+
+        category = await guild.create_category(
+            f"{base.name} ({len(self._overflow[guild.id]) + 2})",
+            overwrites = overwrites,
+            position = base.position + 1
+        )
+
+        await database.Guild(guild).push_to_list('q_categories', category.id)
+
+        self._overflow[guild.id].add(category.id)
+        self._counts[guild.id][category.id] = 0
+        self._open[guild.id].append(category.id)
+
+    async def release(self, guild: discord.Guild, category_id: Union[int, None]) -> None:
+        """Gives back a spot whose channel couldn't be made (deleting its category if it was an empty overflow one).
+
+        Channels that were made free their spot when they're deleted (see channel_deleted).
+        """
+        if category_id not in self._counts.get(guild.id, {}):
+            return
+
+        self._adjust(guild.id, category_id, -1)
+        await self._collect(guild, category_id)
+
+    async def _collect(self, guild: discord.Guild, category_id: int) -> None:
+        if category_id not in self._overflow[guild.id] or self._counts[guild.id][category_id]:
+            return
+
+        category = guild.get_channel(category_id)
+
+        # (only delete it if discord agrees that it's empty)
+        if category and category.channels:
+            return
+
+        self._overflow[guild.id].discard(category_id)
+        del self._counts[guild.id][category_id]
+
+        if category_id in self._open[guild.id]:
+            self._open[guild.id].remove(category_id)
+
+        await database.Guild(guild).pull_from_list('q_categories', category_id)
+
+        if category:
+            await category.delete()
+
+    def forget(self, guild_id: int) -> None:
+        """Drops everything stored for a guild."""
+        self._counts.pop(guild_id, None)
+        self._open.pop(guild_id, None)
+        self._overflow.pop(guild_id, None)
+        self._locks.pop(guild_id, None)
+
+category_pool = CategoryPool()
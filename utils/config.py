@@ -0,0 +1,5 @@
+from configparser import ConfigParser
+
+# config.ini is read once and shared by everything that needs it
+config = ConfigParser()
+config.read("config.ini")
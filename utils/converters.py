@@ -12,4 +12,8 @@ class ValidMethod(commands.Converter):
 
 class ValidAction(commands.Converter):
     async def convert(self, _, given_str: str):
-        return compare(given_str, ["clear", "kick", "ban", "add", "queue"])
\ No newline at end of file
+        return compare(given_str, ["clear", "kick", "ban", "add", "queue"])
+
+class ValidMode(commands.Converter):
+    async def convert(self, _, given_str: str):
+        return compare(given_str, ["channel", "thread"])
\ No newline at end of file
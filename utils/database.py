@@ -1,94 +1,1110 @@
 import discord
 
-import motor.motor_asyncio
+from bson import ObjectId
+from pymongo import DeleteMany, DeleteOne, InsertOne, ReplaceOne, ReturnDocument, UpdateOne
 
-from configparser import ConfigParser
-from typing import Union
+from utils.storage import Backend, MemoryBackend, MongoBackend, apply_update
+from utils.config import config
 
-config = ConfigParser()
-config.read("config.ini")
+from collections import OrderedDict
+from typing import Callable, Union
+import contextlib
+import asyncio
+import logging
+import bisect
+import copy
+import time
 
-# connect to database
-_mongo_uri = str(config.get("mongo", "uri"))
-_mongo_db_name = str(config.get("mongo", "database"))
-_mongo_coll_name = str(config.get("mongo", "collection"))
+log = logging.getLogger("discord")
 
-_mongo_client = motor.motor_asyncio.AsyncIOMotorClient(_mongo_uri)
-_db = _mongo_client[_mongo_db_name][_mongo_coll_name]
+# the backend is made by connect() (in the bot's setup_hook), so importing this doesn't touch mongo
+backend: Union[Backend, None] = None
+_db = None
+
+# moves old guilds into the split collections in the background (see setup)
+_migration: Union[asyncio.Task, None] = None
+
+# lists/dicts that can grow large are kept in their own collections (one entry per document)
+# ("jobs" holds mass actions that are still running, so they can be resumed)
+_collections = dict.fromkeys(("strikes", "user_vcs", "vc_prefs", "quarantine", "caches", "jobs"))
+
+_CACHE_FIELDS = ('role_cache', 'emoji_cache', 'sticker_cache', 'channel_cache')
+_SPLIT_FIELDS = ('quarantine', 'queue', 'user_vcs', 'vc_prefs', *_CACHE_FIELDS)
+
+# fields whose entries are stored as documents keyed by the given id
+_KEYED_FIELDS = {'user_vcs': 'vc_id', 'vc_prefs': 'user_id'}
+
+# used by the cache to tell "not cached" apart from "cached as missing"
+_MISSING = object()
+
+class GuildCache:
+    """An LRU cache (with a time-to-live) that sits in front of guild documents."""
+    def __init__(self, size: int, ttl: float):
+        self.size = size
+        self.ttl = ttl
+
+        self.hits = 0
+        self.misses = 0
+
+        # guild_id -> (time cached, document or None if the guild isn't set up, keys loaded or None if all were)
+        self._entries: OrderedDict[int, tuple[float, Union[dict, None], Union[frozenset, None]]] = OrderedDict()
+
+        # bumped on every write so that reads started before it don't get cached
+        self._generations: dict[int, int] = {}
+
+        # guild_id -> number of writes that have been sent but not acknowledged yet
+        self._writing: dict[int, int] = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def generation(self, guild_id: int) -> int:
+        """Returns the number of writes the cache has seen for a guild."""
+        return self._generations.get(guild_id, 0)
+
+    def get(self, guild_id: int, keys: set = None):
+        """Returns a cached document if it has the given keys (or _MISSING if it isn't cached/has expired)."""
+        entry = self._entries.get(guild_id)
+
+        if entry is None or time.monotonic() - entry[0] > self.ttl:
+            self._entries.pop(guild_id, None)
+            self.misses += 1
+            return _MISSING
+
+        if entry[1] is not None and entry[2] is not None and (keys is None or not keys <= entry[2]):
+            self.misses += 1
+            return _MISSING  # only part of the document is cached
+
+        self._entries.move_to_end(guild_id)
+        self.hits += 1
+
+        return entry[1]
+
+    @contextlib.contextmanager
+    def writing(self, guild_id: int):
+        """Marks a write to a guild as in flight (use with "with" around the write and its cache.update calls).
+
+        Reads that finish while it's in flight aren't cached, since they might already include
+        the write and would then get it applied a second time by cache.update.
+        """
+        self._generations[guild_id] = self.generation(guild_id) + 1
+        self._writing[guild_id] = self._writing.get(guild_id, 0) + 1
+
+        try:
+            yield
+        except BaseException:
+            # the write might have landed, so the cached copy can't be trusted anymore
+            self.invalidate(guild_id)
+            raise
+        finally:
+            if (count := self._writing.pop(guild_id) - 1) > 0:
+                self._writing[guild_id] = count
+
+            self._generations[guild_id] = self.generation(guild_id) + 1
+
+    def set(self, guild_id: int, document: Union[dict, None], generation: int, keys: set = None) -> None:
+        """Caches a document that was read when the guild was at the given generation."""
+        if generation != self.generation(guild_id) or guild_id in self._writing:
+            return  # the guild was (or is being) written to while the document was being read
+
+        entry = (time.monotonic(), document, None if keys is None else frozenset(keys))
+        cached = self._entries.get(guild_id)
+
+        if document is not None and keys is not None and cached and cached[1] is not None and cached[2] is not None:
+            # add the newly loaded keys to the part that's already cached
+            entry = (cached[0], {**cached[1], **document}, cached[2] | entry[2])
+
+        self._entries[guild_id] = entry
+        self._entries.move_to_end(guild_id)
+
+        # evict the least recently used guilds
+        while len(self._entries) > self.size:
+            self._entries.popitem(last = False)
+
+    def update(self, guild_id: int, update: dict) -> None:
+        """Applies an update to a cached document (or drops it if that isn't possible)."""
+        self._generations[guild_id] = self.generation(guild_id) + 1
+        entry = self._entries.get(guild_id)
+
+        if entry is None or entry[1] is None:
+            return self.invalidate(guild_id)
+
+        if entry[2] is not None:
+            # leave out fields that aren't cached
+            update = {
+                operator: {path: value for path, value in fields.items() if path.split('.')[0] in entry[2]}
+                for operator, fields in update.items()
+            }
+
+        try:
+            self._entries[guild_id] = (entry[0], apply_update(entry[1], update), entry[2])
+        except (ValueError, TypeError):
+            self.invalidate(guild_id)
+
+    def invalidate(self, guild_id: int) -> None:
+        """Removes a guild from the cache."""
+        self._generations[guild_id] = self.generation(guild_id) + 1
+        self._entries.pop(guild_id, None)
+
+cache = GuildCache(
+    size = config.getint("cache", "size", fallback = 1000),
+    ttl = config.getfloat("cache", "ttl", fallback = 300)
+)
+
+class QueueIndex:
+    """A guild's quarantine queue: (position, user id) pairs in order, plus each user's position.
+
+    Finding someone's place in line is O(log n), and removing anyone (the head or someone
+    in the middle) is a binary search plus a list delete.
+    """
+    def __init__(self, entries: list[tuple[int, int]]):
+        self._order = sorted(entries)
+        self._positions = {user_id: position for position, user_id in self._order}
+
+    def __len__(self) -> int:
+        return len(self._order)
+
+    def add(self, user_id: int, position: int) -> None:
+        if user_id not in self._positions:
+            self._positions[user_id] = position
+            bisect.insort(self._order, (position, user_id))
+
+    def remove(self, user_id: int) -> bool:
+        if (position := self._positions.pop(user_id, None)) is None:
+            return False
+
+        del self._order[bisect.bisect_left(self._order, (position, user_id))]
+        return True
+
+    def position(self, user_id: int) -> Union[int, None]:
+        """Returns a user's place in line (starting at 1), or None if they aren't queued."""
+        if (position := self._positions.get(user_id)) is None:
+            return None
+
+        return bisect.bisect_left(self._order, (position, user_id)) + 1
+
+    def page(self, start: int, amount: int) -> list[int]:
+        """Returns the ids of the users from start to start + amount."""
+        return [user_id for _, user_id in self._order[start:start + amount]]
+
+# guild id -> queue (only for guilds whose queue has been looked at, see Guild.queue)
+_queues: dict[int, QueueIndex] = {}
+
+# guild id -> number of times its queue has changed (so loads that overlap a change start over)
+_queue_generations: dict[int, int] = {}
+
+def _queue_changed(guild_id: int) -> Union[QueueIndex, None]:
+    """Notes that a guild's queue was written to, returning its index if it's loaded (to update it)."""
+    _queue_generations[guild_id] = _queue_generations.get(guild_id, 0) + 1
+    return _queues.get(guild_id)
+
+class VoiceIndex:
+    """The channels that a guild's voice events matter for: its vc creation channel and its user vcs.
+
+    Kept up to date as user_vcs/vc_make_id are written to (see _write), so voice events in
+    other channels can be ignored without reading the database.
+    """
+    __slots__ = ('make_id', 'vc_ids')
+
+    def __init__(self, make_id: Union[int, None], vc_ids: list[int]):
+        self.make_id = make_id
+        self.vc_ids = set(vc_ids)
+
+    def __contains__(self, channel_id: int) -> bool:
+        return channel_id in self.vc_ids or (channel_id is not None and channel_id == self.make_id)
+
+    def apply(self, update: dict) -> None:
+        """Applies an update (made for the guild's document) to the index."""
+        for operator, fields in update.items():
+            for path, value in fields.items():
+                root, *rest = path.split('.')
+
+                if root == 'vc_make_id':
+                    self.make_id = value if operator == '$set' else None
+
+                elif root == 'user_vcs' and not rest:
+                    self.vc_ids = {int(vc_id) for vc_id in value} if operator == '$set' else set()
+
+                elif root == 'user_vcs' and operator == '$unset' and len(rest) == 1:
+                    self.vc_ids.discard(int(rest[0]))
+
+                # (the same writes that create a vc's entry, see _route)
+                elif root == 'user_vcs' and operator not in ('$unset', '$pull'):
+                    self.vc_ids.add(int(rest[0]))
+
+# guild id -> voice index (only for guilds that have had voice events, see Guild.voice_index)
+_voice: dict[int, VoiceIndex] = {}
+
+# called with (guild id, update) after every update written to a guild (see on_write)
+_write_hooks: list[Callable[[int, dict], None]] = []
+
+def on_write(hook: Callable[[int, dict], None]) -> Callable[[int, dict], None]:
+    """Registers a function to call with (guild id, update) after every update written to a guild."""
+    _write_hooks.append(hook)
+    return hook
+
+def _route(guild_id: int, update: dict) -> tuple[dict, list[tuple[str, object]]]:
+    """Splits an update written for a single guild document into an update for the
+    guild's own document and write operations for the other collections."""
+    main = {}
+    writes = []
+    key = {'guild_id': guild_id}
+
+    # changes to the same keyed entry are sent as one write
+    entries: dict[tuple[str, str], list] = {}
+
+    for operator, fields in update.items():
+        for path, value in fields.items():
+            root, *rest = path.split('.')
+
+            if root in _CACHE_FIELDS and not rest:
+                # one document per cache, holding its entries
+                where = {**key, 'kind': root.removesuffix('_cache')}
+
+                if operator == '$unset':
+                    writes.append(('caches', DeleteOne(where)))
+                else:
+                    writes.append(('caches', UpdateOne(where, {operator: {'entries': value}}, upsert = operator != '$pull')))
+
+            elif root in _KEYED_FIELDS and rest:
+                where = {**key, _KEYED_FIELDS[root]: int(rest[0])}
+
+                if len(rest) > 1:
+                    entry = entries.setdefault((root, rest[0]), [where, {}, False])
+                    entry[1].setdefault(operator, {})['.'.join(rest[1:])] = value
+                    entry[2] = entry[2] or operator not in ('$unset', '$pull')
+                elif operator == '$set':
+                    writes.append((root, ReplaceOne(where, {**where, **value}, upsert = True)))
+                elif operator == '$unset':
+                    writes.append((root, DeleteOne(where)))
+                else:
+                    raise ValueError(f"can't apply {operator} to '{path}'")
+
+            elif root == 'quarantine' and len(rest) == 1:
+                # active quarantines have a channel, queued users have a position
+                where = {**key, 'user_id': int(rest[0])}
+
+                if operator == '$set':
+                    writes.append(('quarantine', UpdateOne(where, {'$set': {'channel_id': value}, '$unset': {'position': 1}}, upsert = True)))
+                elif operator == '$unset':
+                    writes.append(('quarantine', DeleteOne({**where, 'channel_id': {'$exists': True}})))
+                else:
+                    raise ValueError(f"can't apply {operator} to '{path}'")
+
+            elif root == 'queue' and not rest:
+                queued = {**key, 'position': {'$exists': True}}
+
+                if operator == '$push':
+                    position = time.time_ns()
+                    members = value['$each'] if isinstance(value, dict) else [value]
+
+                    for offset, user_id in enumerate(members):
+                        where = {**key, 'user_id': user_id}
+                        writes.append(('quarantine', UpdateOne(where, {'$setOnInsert': {'position': position + offset}}, upsert = True)))
+                elif operator == '$pull':
+                    writes.append(('quarantine', DeleteMany({**queued, 'user_id': value})))
+                elif operator == '$set' and value == []:
+                    writes.append(('quarantine', DeleteMany(queued)))
+                else:
+                    raise ValueError(f"can't apply {operator} to '{path}'")
+
+            elif root == 'strike_topics' and len(rest) == 3 and rest[1] == 'users':
+                # strikes are stored per topic and user, the topic itself stays in the guild's document
+                where = {**key, 'topic': rest[0], 'user_id': int(rest[2])}
+
+                if operator == '$set':
+                    writes.append(('strikes', UpdateOne(where, {'$set': {'strikes': value[0], 'last': value[1]}}, upsert = True)))
+                elif operator == '$unset':
+                    writes.append(('strikes', DeleteOne(where)))
+                else:
+                    raise ValueError(f"can't apply {operator} to '{path}'")
+
+            elif root == 'strike_topics' and len(rest) == 1 and operator in ('$set', '$unset'):
+                # (re)creating or removing a topic replaces all of its strikes
+                writes.append(('strikes', DeleteMany({**key, 'topic': rest[0]})))
+
+                if operator == '$set':
+                    value = dict(value)
+
+                    for user_id, (strikes, last) in value.pop('users', {}).items():
+                        entry = {**key, 'topic': rest[0], 'user_id': int(user_id), 'strikes': strikes, 'last': last}
+                        writes.append(('strikes', InsertOne(entry)))
+
+                main.setdefault(operator, {})[path] = value
+
+            elif root in _SPLIT_FIELDS or (root == 'strike_topics' and not rest) or (root == 'strike_topics' and rest[1:2] == ['users']):
+                raise ValueError(f"'{path}' can't be written to as a whole")
+
+            else:
+                main.setdefault(operator, {})[path] = value
+
+    for (root, _), (where, changes, upsert) in entries.items():
+        writes.append((root, UpdateOne(where, changes, upsert = upsert)))
+
+    return main, writes
+
+def _children(keys: Union[set, None]) -> dict[str, dict]:
+    """Returns the collections (and filters) needed to load the given keys."""
+    if keys is None:
+        # (the queue isn't part of the document, see Guild.queue)
+        children = {name: {} for name in _collections if name != 'jobs'}
+        children['quarantine'] = {'channel_id': {'$exists': True}}
+
+        return children
+
+    children = {}
+
+    if 'strike_topics' in keys:
+        children['strikes'] = {}
+
+    for field in _KEYED_FIELDS:
+        if field in keys:
+            children[field] = {}
+
+    if 'quarantine' in keys:
+        children['quarantine'] = {'channel_id': {'$exists': True}}
+
+    if kinds := [field.removesuffix('_cache') for field in _CACHE_FIELDS if field in keys]:
+        children['caches'] = {'kind': {'$in': kinds}}
+
+    return children
+
+def _assemble(document: dict, children: dict[str, list], keys: Union[set, None] = None) -> dict:
+    """Puts the entries from the other collections back into the guild's document."""
+    document = dict(document)
+    wanted = lambda field: keys is None or field in keys
+
+    # (remove fields that were only projected to check for the old layout)
+    for field in _SPLIT_FIELDS:
+        document.pop(field, None)
+
+    if wanted('strike_topics'):
+        topics = document['strike_topics'] = {
+            topic: {**info, 'users': {}}
+            for topic, info in document.get('strike_topics', {}).items()
+        }
+
+        for entry in children.get('strikes', []):
+            if entry['topic'] in topics:
+                topics[entry['topic']]['users'][str(entry['user_id'])] = [entry['strikes'], entry['last']]
+
+    for field, id_key in _KEYED_FIELDS.items():
+        if wanted(field):
+            document[field] = {str(entry.pop(id_key)): entry for entry in children.get(field, [])}
+
+    if wanted('quarantine'):
+        document['quarantine'] = {
+            str(entry['user_id']): entry['channel_id']
+            for entry in children.get('quarantine', []) if 'channel_id' in entry
+        }
+
+    for field in _CACHE_FIELDS:
+        if wanted(field):
+            document[field] = []
+
+    for entry in children.get('caches', []):
+        document[f"{entry['kind']}_cache"] = entry.get('entries', [])
+
+    return document
+
+def _is_legacy(document: dict) -> bool:
+    """Checks if a guild's document still uses the old single-document layout."""
+    return (
+        any(field in document for field in _SPLIT_FIELDS) or
+        any('users' in topic for topic in document.get('strike_topics', {}).values())
+    )
+
+async def _write(guild_id: int, *updates: dict) -> None:
+    """Writes updates (made for a single guild document) to all of the collections."""
+    main_updates = []
+    writes: dict[str, list] = {}
+
+    for update in updates:
+        # (the queue's index is dropped when it's written to directly, it'll be loaded again when needed)
+        if any(path.split('.')[0] == 'queue' for fields in update.values() for path in fields):
+            _queue_changed(guild_id)
+            _queues.pop(guild_id, None)
+
+        main, child_writes = _route(guild_id, update)
+
+        if main:
+            main_updates.append(main)
+
+        for name, write in child_writes:
+            writes.setdefault(name, []).append(write)
+
+    key = {'guild_id': guild_id}
+    tasks = [_collections[name].bulk_write(ops, ordered = True) for name, ops in writes.items()]
+
+    if len(main_updates) == 1:
+        tasks.append(_db.update_one(key, main_updates[0]))
+    elif main_updates:
+        tasks.append(_db.bulk_write([UpdateOne(key, update) for update in main_updates], ordered = True))
+
+    await asyncio.gather(*tasks)
+
+    if (voice := _voice.get(guild_id)) is not None:
+        for update in updates:
+            voice.apply(update)
+
+    for hook in _write_hooks:
+        for update in updates:
+            hook(guild_id, update)
+
+async def _migrate(document: dict) -> None:
+    """Moves a guild from the old single-document layout into the split collections.
+
+    Every write is an upsert keyed by a unique index, so running this more than once
+    (or from several processes at the same time) is safe.
+    """
+    guild_id = document['guild_id']
+    update = {'$set': {}, '$push': {}}
+
+    for field in _KEYED_FIELDS:
+        for entry_id, entry in document.get(field, {}).items():
+            update['$set'][f'{field}.{entry_id}'] = entry
+
+    for user_id, channel_id in document.get('quarantine', {}).items():
+        update['$set'][f'quarantine.{user_id}'] = channel_id
+
+    for field in _CACHE_FIELDS:
+        if field in document:
+            update['$set'][field] = document[field]
+
+    for topic, info in document.get('strike_topics', {}).items():
+        for user_id, strike in info.get('users', {}).items():
+            update['$set'][f'strike_topics.{topic}.users.{user_id}'] = strike
+
+    if document.get('queue'):
+        update['$push']['queue'] = {'$each': document['queue']}
+
+    await _write(guild_id, {operator: fields for operator, fields in update.items() if fields})
+
+    # only remove the old fields once everything has been copied over
+    unset = {field: 1 for field in _SPLIT_FIELDS if field in document}
+
+    for topic, info in document.get('strike_topics', {}).items():
+        if 'users' in info:
+            unset[f'strike_topics.{topic}.users'] = 1
+
+    # (re)count the quarantine slots that are in use
+    key = {'guild_id': guild_id}
+
+    active, queued = await asyncio.gather(
+        _collections['quarantine'].count_documents({**key, 'position': {'$exists': False}}),
+        _collections['quarantine'].count_documents({**key, 'position': {'$exists': True}})
+    )
+
+    update = {'$set': {'q_active': active, 'q_queued': queued}}
+
+    if unset:
+        update['$unset'] = unset
+
+    await _db.update_one(key, update)
+
+async def _load(guild_id: int, keys: set = None) -> Union[dict, None]:
+    """Reads a guild's document along with its entries in the other collections
+    (only the given keys are loaded if any are given)."""
+    key = {'guild_id': guild_id}
+    no_keys = {'_id': 0, 'guild_id': 0}
+
+    projection = None
+    children = _children(keys)
+
+    if keys is not None:
+        # old layout fields are always included so that the guild can be migrated
+        projection = {field: 1 for field in ('guild_id', *keys, *_SPLIT_FIELDS)}
+
+    document, *results = await asyncio.gather(
+        _db.find_one(key, projection),
+        *[_collections[name].find({**key, **where}, no_keys).to_list(None) for name, where in children.items()]
+    )
+
+    if document is None:
+        return None
+
+    if _is_legacy(document):
+        await _migrate(document)
+        return await _load(guild_id, keys)
+
+    return _assemble(document, dict(zip(children, results)), keys)
+
+async def migrate() -> None:
+    """Moves every guild that still uses the old layout into the split collections."""
+    # (guilds without the quarantine slot counters are recounted too)
+    query = {'$or': [*({field: {'$exists': True}} for field in _SPLIT_FIELDS), {'q_active': {'$exists': False}}]}
+
+    async for found in _db.find(query, {'guild_id': 1}):
+        # (read again right before moving it, since the guild might've been migrated when it was
+        # first read, and an old copy of it would then overwrite newer writes)
+        if document := await _db.find_one({**query, 'guild_id': found['guild_id']}):
+            await _migrate(document)
+            cache.invalidate(document['guild_id'])
+
+async def _migrate_in_background() -> None:
+    try:
+        await migrate()
+    except Exception:
+        # (guilds that weren't moved are still migrated when they're first read)
+        log.exception("couldn't migrate every guild")
+
+async def quarantine_channels() -> list[int]:
+    """Returns the ids of every open quarantine channel (in every guild)."""
+    entries = await _collections['quarantine'].find({'channel_id': {'$exists': True}}, {'channel_id': 1}).to_list(None)
+    return [entry['channel_id'] for entry in entries]
+
+async def jobs() -> list[dict]:
+    """Returns every mass action that didn't finish (in every guild)."""
+    return await _collections['jobs'].find({}).to_list(None)
+
+async def connect() -> None:
+    """Connects to the storage backend chosen in config.ini ([storage] backend = mongo/memory)."""
+    global backend, _db
+
+    kind = config.get("storage", "backend", fallback = "mongo")
+
+    if kind == "memory":
+        backend = MemoryBackend()
+        collection = "guilds"
+
+    elif kind == "mongo":
+        mongo = config["mongo"]
+
+        # optional pool/compression/timeout settings (pymongo's defaults are used for missing ones)
+        options = {
+            'maxPoolSize': mongo.getint("max_pool_size", fallback = None),
+            'minPoolSize': mongo.getint("min_pool_size", fallback = None),
+            'compressors': mongo.get("compressors", fallback = None),
+            'connectTimeoutMS': mongo.getint("connect_timeout_ms", fallback = None),
+            'socketTimeoutMS': mongo.getint("socket_timeout_ms", fallback = None),
+            'serverSelectionTimeoutMS': mongo.getint("server_selection_timeout_ms", fallback = None)
+        }
+
+        backend = MongoBackend(
+            mongo.get("uri"),
+            mongo.get("database"),
+            **{option: value for option, value in options.items() if value is not None}
+        )
+
+        collection = mongo.get("collection")
+
+    else:
+        raise ValueError(f"unknown storage backend '{kind}'")
+
+    _db = backend.collection(collection)
+
+    for name in _collections:
+        _collections[name] = backend.collection(f"{collection}_{name}")
+
+    await setup()
+
+def close() -> None:
+    """Closes the storage backend."""
+    if _migration is not None:
+        _migration.cancel()
+
+    if backend is not None:
+        backend.close()
+
+async def setup() -> None:
+    """Creates the indexes used by every collection and starts migrating old guilds.
+
+    The migration runs in the background so it doesn't hold up the bot starting (guilds that
+    haven't been moved yet are migrated when they're first read, see _load).
+    """
+    global _migration
+
+    await asyncio.gather(
+        _db.create_index('guild_id', unique = True),
+        _collections['strikes'].create_index([('guild_id', 1), ('topic', 1), ('user_id', 1)], unique = True),
+        _collections['strikes'].create_index([('guild_id', 1), ('user_id', 1)]),
+        _collections['user_vcs'].create_index([('guild_id', 1), ('vc_id', 1)], unique = True),
+        _collections['user_vcs'].create_index([('guild_id', 1), ('user_id', 1)]),
+        _collections['vc_prefs'].create_index([('guild_id', 1), ('user_id', 1)], unique = True),
+        _collections['quarantine'].create_index([('guild_id', 1), ('user_id', 1)], unique = True),
+        _collections['quarantine'].create_index([('guild_id', 1), ('position', 1)]),
+        _collections['caches'].create_index([('guild_id', 1), ('kind', 1)], unique = True),
+        _collections['jobs'].create_index('guild_id')
+    )
+
+    _migration = asyncio.create_task(_migrate_in_background())
+
+class FieldNotLoaded(AttributeError):
+    """Raised when accessing a field that wasn't included in Guild.get(fields = [...])."""
+
+class _Field:
+    """A document field, read from the raw document when it's accessed."""
+    __slots__ = ('name', 'key', 'default')
+
+    def __init__(self, key: str, default = None):
+        self.key = key
+        self.default = default
+
+    def __set_name__(self, owner, name: str):
+        self.name = name
+
+    def __get__(self, document: 'Document', owner = None):
+        if document is None:
+            return self
+
+        if document._fields is not None and self.name not in document._fields:
+            raise FieldNotLoaded(f"'{self.name}' wasn't loaded (add it to the fields given to Guild.get())")
+
+        try:
+            return document._raw[self.key]
+        except KeyError:
+            pass
+
+        if not isinstance(self.default, (list, dict)):
+            return self.default
+
+        # empty lists/dicts are only made once per document (and only if they're used)
+        if document._defaults is None:
+            document._defaults = {}
+
+        if self.name not in document._defaults:
+            document._defaults[self.name] = copy.copy(self.default)
+
+        return document._defaults[self.name]
 
 class Document:
-    def __init__(self, document: dict):
-        if document:
-            # list of variables used throughout the bot
-            # this can probably be done in automatically but this gives type hints
-            get = lambda key, default: document.get(key, default)
-
-            self.queue: list = get('queue', [])
-            self.method: str = get('method', None)
-            self.log_id: int = get('log_id', None)
-            self.wait_id: int = get('wait_id', None)
-            self.actions: int = get('actions', None)
-            self.min_age: int = get('min_age', None)
-            self.history: int = get('history', None)
-            self.allowed: list = get('allowed', [])
-            self.user_vcs: dict = get('user_vcs', {})
-            self.priority: list = get('priority', [])
-            self.lockdown: bool = get('lockdown', False)
-            self.vc_prefs: dict = get('vc_prefs', {})
-            self.q_role_id: int = get('q_role_id', None)
-            self.vc_make_id: int = get('vc_make_id', None)
-            self.quarantine: dict = get('quarantine', {})
-            self.role_cache: list = get('role_cache', [])
-            self.emoji_cache: list = get('emoji_cache', [])
-            self.sticker_cache: list = get('sticker_cache', [])
-            self.channel_cache: list = get('channel_cache', [])
-            self.strike_topics: dict = get('strike_topics', {})
-            self.watching_roles: bool = get('watch_roles', False)
-            self.watching_emojis: bool = get('watch_emojis', False)
-            self.watching_channels: bool = get('watch_channels', False)
+    """A guild's database entry.
+
+    The raw document is kept as it is and fields are only read from it when they're
+    accessed, so making a Document doesn't copy anything.
+    """
+    __slots__ = ('_raw', '_fields', '_defaults')
+
+    slots: int = _Field('q_slots', 5)
+    queued: int = _Field('q_queued', 0)
+    method: str = _Field('method')
+    q_mode: str = _Field('q_mode', 'channel')
+    log_id: int = _Field('log_id')
+    wait_id: int = _Field('wait_id')
+    actions: int = _Field('actions')
+    min_age: int = _Field('min_age')
+    history: int = _Field('history')
+    allowed: list = _Field('allowed', [])
+    user_vcs: dict = _Field('user_vcs', {})
+    priority: list = _Field('priority', [])
+    lockdown: bool = _Field('lockdown', False)
+    vc_prefs: dict = _Field('vc_prefs', {})
+    incidents: list = _Field('incidents', [])
+    q_role_id: int = _Field('q_role_id')
+    vc_make_id: int = _Field('vc_make_id')
+    wait_role_id: int = _Field('wait_role_id')
+    quarantine: dict = _Field('quarantine', {})
+    q_channel_id: int = _Field('q_channel_id')
+    q_categories: list = _Field('q_categories', [])
+    quarantined: int = _Field('q_active', 0)
+    role_cache: list = _Field('role_cache', [])
+    emoji_cache: list = _Field('emoji_cache', [])
+    sticker_cache: list = _Field('sticker_cache', [])
+    channel_cache: list = _Field('channel_cache', [])
+    strike_topics: dict = _Field('strike_topics', {})
+    watching_roles: bool = _Field('watch_roles', False)
+    watching_emojis: bool = _Field('watch_emojis', False)
+    watching_channels: bool = _Field('watch_channels', False)
+
+    def __init__(self, document: dict, fields: list[str] = None):
+        self._raw = document
+        self._fields = fields  # (None if every field was loaded)
+        self._defaults = None
+
+# attribute -> (key in the database, default value)
+Document.FIELDS = {
+    name: (field.key, field.default)
+    for name, field in vars(Document).items() if isinstance(field, _Field)
+}
+
+def _push(value, limit: Union[int, None]) -> dict:
+    """Makes the $push for a value (with a $slice to cap the list if a limit is given)."""
+    return {'$each': [value]} if limit is None else {'$each': [value], '$slice': -limit}
+
+class Batch:
+    """Collects updates to a guild's document and sends them as one write.
+
+    Operations are merged into a single update unless two of them touch the same
+    path (or a parent/child of it) in a way that can't be combined, in which case
+    a new stage is started and the stages are sent in order using bulk_write.
+    """
+    def __init__(self, guild: 'Guild'):
+        self.guild = guild
+        self.stages: list[dict] = [{}]
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        # like a transaction, nothing is written if the block failed
+        if exc_type is None:
+            await self.flush()
+
+    def _conflicts(self, stage: dict, path: str) -> bool:
+        """Checks if a path overlaps with any path already used in a stage."""
+        for fields in stage.values():
+            for other in fields:
+                if other == path or other.startswith(path + '.') or path.startswith(other + '.'):
+                    return True
+
+        return False
+
+    def _merge(self, operator: str, old, new):
+        """Combines two operations on the same path (returns _MISSING if they can't be)."""
+        if operator in ('$set', '$unset'):
+            return new  # the last write wins either way
+
+        if operator == '$inc':
+            return old + new
+
+        if operator == '$push':
+            if old.get('$slice') != new.get('$slice'):
+                return _MISSING
+
+            return {**old, '$each': old['$each'] + new['$each']}
+
+        if operator == '$pull':
+            # plain values (or other $in lists) can be pulled together using $in
+            values = []
+
+            for value in (old, new):
+                if isinstance(value, dict):
+                    if list(value) != ['$in']:
+                        return _MISSING
+
+                    values += value['$in']
+                else:
+                    values.append(value)
+
+            return {'$in': values}
+
+        return _MISSING
+
+    def _add(self, operator: str, path: str, value) -> 'Batch':
+        stage = self.stages[-1]
+        fields = stage.get(operator, {})
+
+        if path in fields:
+            merged = self._merge(operator, fields[path], value)
+
+            if merged is not _MISSING:
+                fields[path] = merged
+                return self
+
+        if self._conflicts(stage, path):
+            stage = {}
+            self.stages.append(stage)
+
+        stage.setdefault(operator, {})[path] = value
+        return self
+
+    def increment(self, amount: int = 1) -> 'Batch':
+        return self._add('$inc', 'actions', amount)
+
+    def push_to_list(self, field: str, value, limit: int = None) -> 'Batch':
+        return self._add('$push', field, _push(value, limit))
+
+    def pull_from_list(self, field: str, value) -> 'Batch':
+        return self._add('$pull', field, value)
+
+    def clear_list(self, field: str) -> 'Batch':
+        return self._add('$set', field, [])
+
+    def set_field(self, field: str, value) -> 'Batch':
+        return self._add('$set', field, value)
+
+    def del_field(self, field: str) -> 'Batch':
+        return self._add('$unset', field, 1)
+
+    async def flush(self) -> None:
+        """Sends every collected operation to the database."""
+        stages = [stage for stage in self.stages if stage]
+        self.stages = [{}]
+
+        if stages:
+            await self.guild._update(*stages)
 
 class Guild:
     def __init__(self, guild: discord.Guild):
         self.guild = {'guild_id': guild.id}
         self.guild_id = guild.id
 
+    async def _update(self, *updates: dict) -> None:
+        """Applies updates (in order) to the guild's document and its cached copy."""
+        with cache.writing(self.guild_id):
+            await _write(self.guild_id, *updates)
+
+            for update in updates:
+                cache.update(self.guild_id, update)
+
+    def batch(self) -> Batch:
+        """Returns a batch that sends all of its updates at once (use with "async with")."""
+        return Batch(self)
+
     async def exists(self) -> bool:
         """Checks if a guild exists in the database."""
-        return await _db.count_documents(self.guild, limit = 1)
+        return (await self.get([])) is not None
 
     async def delete(self) -> None:
         """Deletes a guild from the database."""
-        await _db.delete_one(self.guild)
+        await asyncio.gather(
+            _db.delete_one(self.guild),
+            *[collection.delete_many(self.guild) for collection in _collections.values()]
+        )
+
+        cache.invalidate(self.guild_id)
+        _queue_changed(self.guild_id)
+        _queues.pop(self.guild_id, None)
+        _voice.pop(self.guild_id, None)
+
+    async def create_job(self, action: str, user_ids: list[int], **info) -> ObjectId:
+        """Saves a mass action that's about to run (info is stored with it, e.g. the progress message's id)."""
+        result = await _collections['jobs'].insert_one({
+            **self.guild,
+            'action': action,
+            'user_ids': user_ids,
+            'done': [],
+            **info
+        })
+
+        return result.inserted_id
+
+    async def job_progress(self, job_id: ObjectId, done: list[int]) -> None:
+        """Marks members as done in a mass action."""
+        await _collections['jobs'].update_one({'_id': job_id}, {'$push': {'done': {'$each': done}}})
+
+    async def finish_job(self, job_id: ObjectId) -> None:
+        """Removes a mass action once it has finished."""
+        await _collections['jobs'].delete_one({'_id': job_id})
 
     async def increment(self, amount: int = 1) -> None:
         """Increases the total number of 'actions' by the amount specified."""
-        await _db.update_one(self.guild, {'$inc': {'actions': amount}})
+        await self._update({'$inc': {'actions': amount}})
 
-    async def push_to_list(self, field: str, value) -> None:
-        """Pushes a value to the given field."""
-        await _db.update_one(self.guild, {'$push': {field: {'$each': [value]}}})
+    async def push_to_list(self, field: str, value, limit: int = None) -> None:
+        """Pushes a value to the given field (keeping only the last `limit` values if it's given)."""
+        await self._update({'$push': {field: _push(value, limit)}})
 
     async def pull_from_list(self, field: str, value) -> None:
         """Pulls (removes) a value from a given field."""
-        await _db.update_one(self.guild, {'$pull': {field: value}})
+        await self._update({'$pull': {field: value}})
 
     async def clear_list(self, field: str) -> None:
         """Clears the given field's list."""
-        await _db.update_one(self.guild, {'$set': {field: []}})
+        await self._update({'$set': {field: []}})
 
     async def set_field(self, field: str, value) -> None:
         """Creates/sets the specified field to a given value."""
-        await _db.update_one(self.guild, {'$set': {field: value}})
+        await self._update({'$set': {field: value}})
 
     async def del_field(self, field: str) -> None:
         """Removes the specified field."""
-        await _db.update_one(self.guild, {'$unset': {field: 1}})
+        await self._update({'$unset': {field: 1}})
+
+    async def reserve_quarantine(self, user_id: int, fields: list[str]) -> tuple[Union[Document, None], int]:
+        """Atomically takes a quarantine slot for a user (or a place in the queue if every slot is in use).
+
+        The guild's slot limit is checked as part of the update, so nothing has to be read first.
+
+        Returns the guild's document (only with the given fields, which have to be in the guild's
+        own document) and the user's place in the queue (0 if they got a slot), or (None, 0) if the
+        user is already quarantined/queued.
+        """
+        entries = _collections['quarantine']
+        key = {**self.guild, 'user_id': user_id}
+        projection = {Document.FIELDS[field][0]: 1 for field in fields}
+
+        # the unique index makes sure only one quarantine can be started per user
+        # (the entry stays pending until the counters have been updated, so release_quarantine leaves it alone until then)
+        claim = await entries.update_one(key, {'$setOnInsert': {'pending': True}}, upsert = True)
+
+        if claim.upserted_id is None:
+            return None, 0
+
+        counted = None
+
+        try:
+            with cache.writing(self.guild_id):
+                # (guilds that don't have the counter/limit yet count as having none in use/the default)
+                document = await _db.find_one_and_update(
+                    {**self.guild, '$expr': {'$lt': [{'$ifNull': ['$q_active', 0]}, {'$ifNull': ['$q_slots', Document.slots.default]}]}},
+                    {'$inc': {'q_active': 1, 'actions': 1}},
+                    projection = projection,
+                    return_document = ReturnDocument.AFTER
+                )
+
+                if document:
+                    counted = 'q_active'
+                else:
+                    # every slot is taken, so add the user to the end of the queue
+                    document = await _db.find_one_and_update(
+                        self.guild,
+                        {'$inc': {'q_queued': 1, 'actions': 1}},
+                        projection = {**projection, 'q_queued': 1},
+                        return_document = ReturnDocument.AFTER
+                    )
+
+                    counted = 'q_queued' if document else None
+
+                if counted:
+                    cache.update(self.guild_id, {'$inc': {counted: 1, 'actions': 1}})
+
+            if document is None:
+                await entries.delete_one(key)
+                return None, 0  # the guild isn't set up
+
+            if counted == 'q_active':
+                await entries.update_one(key, {'$set': {'reserved': True}, '$unset': {'pending': 1}})
+                return Document(document, fields), 0
+
+            position = time.time_ns()
+            await entries.update_one(key, {'$set': {'position': position}, '$unset': {'pending': 1}})
+        except BaseException:
+            # don't leave the user stuck with a claim (or the guild with a slot/queue place nobody has)
+            await entries.delete_one(key)
+
+            if counted:
+                await _db.update_one(self.guild, {'$inc': {counted: -1}})
+                cache.invalidate(self.guild_id)
+
+            raise
+
+        if (queue := _queue_changed(self.guild_id)) is not None:
+            queue.add(user_id, position)
+
+        # (the place in line comes from the index, since q_queued also counts people that are ahead and leaving)
+        queue = await self.queue()
+        return Document(document, fields), queue.position(user_id) or document['q_queued']
+
+    async def start_quarantine(self, user_id: int, channel_id: int) -> bool:
+        """Sets the channel of a reserved quarantine (False if the reservation was released in the meantime)."""
+        with cache.writing(self.guild_id):
+            result = await _collections['quarantine'].update_one(
+                {**self.guild, 'user_id': user_id, 'position': {'$exists': False}},
+                {'$set': {'channel_id': channel_id}, '$unset': {'reserved': 1}}
+            )
+
+            if result.matched_count:
+                cache.update(self.guild_id, {'$set': {f'quarantine.{user_id}': channel_id}})
+
+        return bool(result.matched_count)
+
+    async def release_quarantine(self, user_id: int) -> Union[dict, None]:
+        """Removes a user from quarantine/the queue and frees up their slot (returns the removed entry)."""
+        with cache.writing(self.guild_id):
+            # (pending entries are still being reserved, so it's not known yet which counter they're in)
+            entry = await _collections['quarantine'].find_one_and_delete({**self.guild, 'user_id': user_id, 'pending': {'$exists': False}})
 
-    async def get(self) -> Union[Document, None]:
-        """Returns the guild's database entry as a class."""
-        _doc = await _db.find_one(self.guild)
+            if entry is None:
+                return None
 
-        return Document(_doc) if _doc else None
+            if 'position' in entry:
+                update = {'$inc': {'q_queued': -1}}
+            else:
+                update = {'$unset': {f'quarantine.{user_id}': 1}, '$inc': {'q_active': -1}}
+
+            await _db.update_one(self.guild, {'$inc': update['$inc']})
+            cache.update(self.guild_id, update)
+
+        if 'position' in entry and (queue := _queue_changed(self.guild_id)) is not None:
+            queue.remove(user_id)
+
+        return entry
+
+    async def promote(self, slots: int) -> list[int]:
+        """Moves users from the front of the queue into every free quarantine slot (returns their ids).
+
+        The users' entries are left reserved, so start_quarantine still has to be called for each one.
+        """
+        entries = _collections['quarantine']
+
+        with cache.writing(self.guild_id):
+            while True:
+                document = await _db.find_one(self.guild, {'q_active': 1})
+
+                if document is None or (free := slots - document.get('q_active', 0)) <= 0:
+                    return []
+
+                # take the free slots in one step ("not > slots - free" means there's still room for all of them)
+                if await _db.find_one_and_update({**self.guild, 'q_active': {'$not': {'$gt': slots - free}}}, {'$inc': {'q_active': free}}):
+                    break
+
+                # someone else took (or gave back) a slot in the meantime, so try again with the new count
+
+            promoted = []
+
+            for _ in range(free):
+                # each entry is taken off the queue on its own, so the same user can't be promoted twice
+                entry = await entries.find_one_and_update(
+                    {**self.guild, 'position': {'$exists': True}},
+                    {'$unset': {'position': 1}, '$set': {'reserved': True}},
+                    sort = [('position', 1)]
+                )
+
+                if entry is None:
+                    break
+
+                promoted.append(entry['user_id'])
+
+            # give back the slots that weren't needed, and take the promoted users out of the queue count
+            await _db.update_one(self.guild, {'$inc': {'q_active': len(promoted) - free, 'q_queued': -len(promoted)}})
+            cache.update(self.guild_id, {'$inc': {'q_active': len(promoted), 'q_queued': -len(promoted)}})
+
+        if promoted and (queue := _queue_changed(self.guild_id)) is not None:
+            for user_id in promoted:
+                queue.remove(user_id)
+
+        return promoted
+
+    async def queue(self) -> QueueIndex:
+        """Returns the guild's quarantine queue (it's loaded the first time, then kept up to date)."""
+        while (queue := _queues.get(self.guild_id)) is None:
+            generation = _queue_generations.get(self.guild_id, 0)
+
+            entries = await _collections['quarantine'].find(
+                {**self.guild, 'position': {'$exists': True}},
+                {'user_id': 1, 'position': 1}
+            ).to_list(None)
+
+            # (if the queue changed while it was being read, the change might be missing from what was read, so read it again)
+            if generation == _queue_generations.get(self.guild_id, 0):
+                _queues[self.guild_id] = QueueIndex([(entry['position'], entry['user_id']) for entry in entries])
+
+        return queue
+
+    async def voice_index(self) -> VoiceIndex:
+        """Returns the channels the guild's voice events matter for (loaded the first time, then kept up to date)."""
+        if (index := _voice.get(self.guild_id)) is None:
+            guild = await self.get(['vc_make_id'])
+            entries = await _collections['user_vcs'].find(self.guild, {'vc_id': 1}).to_list(None)
+
+            # (another call might have loaded it in the meantime)
+            index = _voice.setdefault(self.guild_id, VoiceIndex(guild.vc_make_id if guild else None, [entry['vc_id'] for entry in entries]))
+
+        return index
+
+    async def get(self, fields: list[str] = None) -> Union[Document, None]:
+        """Returns the guild's database entry as a class.
+
+        If a list of fields (Document attributes) is given, only those are loaded
+        and accessing any other field raises FieldNotLoaded.
+        """
+        keys = None
+
+        if fields is not None:
+            if unknown := [field for field in fields if field not in Document.FIELDS]:
+                raise ValueError(f"unknown fields: {', '.join(unknown)}")
+
+            keys = {Document.FIELDS[field][0] for field in fields}
+
+        _doc = cache.get(self.guild_id, keys)
+
+        if _doc is _MISSING:
+            generation = cache.generation(self.guild_id)
+            _doc = await _load(self.guild_id, keys)
+            cache.set(self.guild_id, _doc, generation, keys)
+
+        return Document(_doc, fields) if _doc else None
 
     async def add_guild(
         self,
@@ -100,7 +1116,8 @@ class Guild:
         watch_roles: bool,
         q_role: int,
         wait_id: int,
-        history: int
+        history: int,
+        wait_role: int = None
     ) -> None:
         """Adds a guild to the database using the ids given in setup."""
         await _db.insert_one({
@@ -108,6 +1125,7 @@ class Guild:
             'actions': 0,
             'log_id': log_id,
             'wait_id': wait_id,
+            'wait_role_id': wait_role,
             'history': history,
             'q_role_id': q_role,
             'method': method.lower(),
@@ -116,12 +1134,10 @@ class Guild:
             'watch_emojis': watch_emojis,
             'watch_roles': watch_roles,
             'lockdown': False,
-            'quarantine': {},
-            'queue': [],
-            'role_cache': [],
-            'emoji_cache': [],
-            'sticker_cache': [],
-            'channel_cache': [],
+            'q_active': 0,
+            'q_queued': 0,
             'allowed': [],
             'priority': []
         })
+
+        cache.invalidate(self.guild_id)
@@ -0,0 +1,137 @@
+import discord
+
+from utils.config import config
+
+from collections import deque
+from datetime import datetime, timezone
+import asyncio
+import logging
+import time
+import csv
+import io
+
+log = logging.getLogger("discord")
+
+# discord's limits for the embeds in a single message
+_MAX_EMBEDS = 10
+_MAX_EMBED_CHARACTERS = 6000
+_MAX_DESCRIPTION = 4096
+
+def _summary(embed: discord.Embed) -> str:
+    """Returns what an entry is about in a few words (its title or author)."""
+    return embed.title or embed.author.name or "(no title)"
+
+def _to_csv(entries: list[tuple[datetime, discord.Embed]]) -> discord.File:
+    """Writes entries as rows of a csv file."""
+    output = io.StringIO()
+    writer = csv.writer(output)
+
+    writer.writerow(["time", "entry", "description", "details"])
+
+    for date, embed in entries:
+        details = " | ".join(f"{field.name} {field.value}" for field in embed.fields)
+        writer.writerow([date.isoformat(), _summary(embed), embed.description or "", details])
+
+    return discord.File(io.BytesIO(output.getvalue().encode("utf8")), filename = "log.csv")
+
+class LogDigest:
+    """Sends log embeds right away, unless a channel is getting more than `rate` of them per `window` seconds.
+
+    Busy channels get their entries collected and sent every `interval` seconds instead, as a
+    single message (several embeds, or a summary with a csv file of every entry if there are too
+    many), so logging doesn't use up the rate limits that moderation actions need.
+    """
+    def __init__(self, rate: int, window: float, interval: float):
+        self.rate = rate
+        self.window = window
+        self.interval = interval
+
+        # channel id -> when its latest entries were logged
+        self._recent: dict[int, deque[float]] = {}
+
+        # channel id -> entries waiting to be sent (and the channel to send them to)
+        self._pending: dict[int, list[tuple[datetime, discord.Embed]]] = {}
+        self._channels: dict[int, discord.abc.Messageable] = {}
+        self._tasks: dict[int, asyncio.Task] = {}
+
+    async def send(self, channel: discord.abc.Messageable, embed: discord.Embed) -> None:
+        """Logs an embed to a channel (now if it's quiet, with the next digest if it's busy)."""
+        now = time.monotonic()
+        recent = self._recent.setdefault(channel.id, deque())
+
+        while recent and recent[0] <= now - self.window:
+            recent.popleft()
+
+        recent.append(now)
+
+        if channel.id not in self._pending and len(recent) <= self.rate:
+            await channel.send(embed = embed)
+            return
+
+        self._pending.setdefault(channel.id, []).append((embed.timestamp or discord.utils.utcnow(), embed))
+        self._channels[channel.id] = channel
+
+        if channel.id not in self._tasks:
+            self._tasks[channel.id] = asyncio.create_task(self._flush_later(channel.id))
+
+    async def _flush_later(self, channel_id: int) -> None:
+        await asyncio.sleep(self.interval)
+
+        del self._tasks[channel_id]
+        await self.flush(channel_id)
+
+    async def flush(self, channel_id: int) -> None:
+        """Sends every entry waiting to be sent to a channel."""
+        entries = self._pending.pop(channel_id, [])
+        channel = self._channels.pop(channel_id, None)
+
+        if not entries or channel is None:
+            return
+
+        embeds = [embed for _, embed in entries]
+
+        try:
+            if len(embeds) <= _MAX_EMBEDS and sum(len(embed) for embed in embeds) <= _MAX_EMBED_CHARACTERS:
+                await channel.send(embeds = embeds)
+                return
+
+            # too many for one message, so list them briefly and attach all of them
+            embed = discord.Embed(
+                title = f"{len(entries)} log entries",
+                color = discord.Color.dark_red(),
+                timestamp = entries[-1][0]
+            )
+
+            lines = []
+            length = 0
+
+            for date, entry in entries:
+                line = f"<t:{int(date.replace(tzinfo = date.tzinfo or timezone.utc).timestamp())}:T> {_summary(entry)}"
+
+                if length + len(line) + 1 > _MAX_DESCRIPTION - 32:
+                    lines.append(f"(and {len(entries) - len(lines)} more, see log.csv)")
+                    break
+
+                lines.append(line)
+                length += len(line) + 1
+
+            embed.description = "\n".join(lines)
+
+            await channel.send(embed = embed, file = _to_csv(entries))
+        except discord.HTTPException:
+            log.exception(f"couldn't send {len(entries)} log entries to {channel_id}")
+
+    async def close(self) -> None:
+        """Sends everything that's still waiting (used when shutting down)."""
+        for task in self._tasks.values():
+            task.cancel()
+
+        self._tasks.clear()
+
+        await asyncio.gather(*[self.flush(channel_id) for channel_id in list(self._pending)])
+
+log_digest = LogDigest(
+    rate = config.getint("logs", "rate", fallback = 5),
+    window = config.getfloat("logs", "window", fallback = 5),
+    interval = config.getfloat("logs", "interval", fallback = 5)
+)
@@ -0,0 +1,215 @@
+import discord
+
+from utils.base import BaseEmbed
+from utils.config import config
+from utils import database
+
+from bson import ObjectId
+from typing import Awaitable, Callable
+import asyncio
+import logging
+
+log = logging.getLogger("discord")
+
+_CONCURRENCY = config.getint("mass", "concurrency", fallback = 5)
+_RETRIES = config.getint("mass", "retries", fallback = 4)
+
+# how often (in seconds) progress is saved and shown
+_PROGRESS_INTERVAL = config.getfloat("mass", "progress_interval", fallback = 2)
+
+# ids of the mass actions running right now (on_ready can fire more than once)
+_running: set[ObjectId] = set()
+
+# action -> (in progress, done)
+VERBS = {
+    'clear': ("Clearing", "Cleared"),
+    'kick': ("Kicking", "Kicked"),
+    'ban': ("Banning", "Banned")
+}
+
+async def retry(call: Callable[[], Awaitable]):
+    """Makes an API call, retrying it (with backoff) if it gets rate limited or discord has an error.
+
+    discord.py already waits out each route's rate limit bucket, this only deals with
+    the requests it gives up on.
+    """
+    for attempt in range(_RETRIES + 1):
+        try:
+            return await call()
+        except discord.HTTPException as error:
+            if attempt == _RETRIES or not (error.status == 429 or error.status >= 500):
+                raise
+
+            await asyncio.sleep(2 ** attempt)
+
+async def apply(guild: discord.Guild, action: str, user_id: int, role: discord.Role = None) -> bool:
+    """Clears/kicks/bans a member (returns False if there was nobody to do it to)."""
+    if action == 'ban':
+        # (bans work even if the member already left)
+        await retry(lambda: guild.ban(discord.Object(user_id)))
+        return True
+
+    if (member := guild.get_member(user_id)) is None or (action == 'clear' and role is None):
+        return False
+
+    if action == 'kick':
+        await retry(lambda: member.kick())
+    elif action == 'clear':
+        await retry(lambda: member.remove_roles(role))
+
+    return True
+
+class MassAction:
+    """Clears/kicks/bans a list of members with bounded concurrency.
+
+    Members are done `[mass] concurrency` at a time, unless a semaphore is given to share
+    with other work (like the join queue's). The action is saved before it starts and members are marked as done as it goes,
+    so that it can be resumed (see resume_all) if the bot restarts in the middle of it.
+    """
+    def __init__(
+        self,
+        guild: discord.Guild,
+        action: str,
+        user_ids: list[int],
+        role: discord.Role = None,
+        message: discord.Message = None,
+        job_id: ObjectId = None,
+        done: list[int] = (),
+        semaphore: asyncio.Semaphore = None
+    ):
+        self.guild = guild
+        self.action = action
+        self.user_ids = user_ids
+        self.role = role
+        self.message = message
+        self.job_id = job_id
+        self.semaphore = semaphore
+
+        self.done: list[int] = list(done)
+        self.failed: list[int] = []
+
+        self._saved = len(self.done)
+        self._db = database.Guild(guild)
+
+    @classmethod
+    async def start(
+        cls,
+        guild: discord.Guild,
+        action: str,
+        user_ids: list[int],
+        role: discord.Role = None,
+        message: discord.Message = None,
+        semaphore: asyncio.Semaphore = None
+    ) -> 'MassAction':
+        """Saves a new mass action (it still has to be run)."""
+        job_id = await database.Guild(guild).create_job(
+            action,
+            user_ids,
+            role_id = role.id if role else None,
+            channel_id = message.channel.id if message else None,
+            message_id = message.id if message else None
+        )
+
+        return cls(guild, action, user_ids, role, message, job_id, semaphore = semaphore)
+
+    @property
+    def progress_embed(self) -> discord.Embed:
+        doing, did = VERBS[self.action]
+        total = len(self.user_ids)
+
+        if len(self.done) + len(self.failed) < total:
+            return BaseEmbed(description = f"{doing} members... **{len(self.done)}/{total}**")
+
+        embed = BaseEmbed(description = f"**{did} {len(self.done)} member(s).**")
+
+        if self.failed:
+            embed.description += f"\n(couldn't do it to {len(self.failed)})"
+
+        embed.color = discord.Color.brand_green()
+        return embed
+
+    async def _save_progress(self) -> None:
+        if self.job_id and len(self.done) > self._saved:
+            newly_done = self.done[self._saved:]
+            self._saved = len(self.done)
+
+            await self._db.job_progress(self.job_id, newly_done)
+
+        if self.message:
+            try:
+                await self.message.edit(embed = self.progress_embed)
+            except discord.HTTPException:
+                self.message = None  # (stop trying if the message was deleted)
+
+    async def _report(self) -> None:
+        while True:
+            await asyncio.sleep(_PROGRESS_INTERVAL)
+            await self._save_progress()
+
+    async def run(self) -> 'MassAction':
+        """Runs the action on every member that isn't done yet."""
+        if self.job_id in _running:
+            return self
+
+        if self.job_id:
+            _running.add(self.job_id)
+
+        try:
+            await self._run()
+        finally:
+            _running.discard(self.job_id)
+
+        return self
+
+    async def _run(self) -> None:
+        semaphore = self.semaphore or asyncio.Semaphore(_CONCURRENCY)
+        already_done = set(self.done)
+
+        async def run_one(user_id: int):
+            async with semaphore:
+                try:
+                    if await apply(self.guild, self.action, user_id, self.role):
+                        self.done.append(user_id)
+                    else:
+                        self.failed.append(user_id)
+                except discord.HTTPException:
+                    log.exception(f"couldn't {self.action} {user_id} in {self.guild.id}")
+                    self.failed.append(user_id)
+
+        reporter = asyncio.create_task(self._report())
+
+        try:
+            await asyncio.gather(*[run_one(user_id) for user_id in self.user_ids if user_id not in already_done])
+        finally:
+            reporter.cancel()
+
+        await self._save_progress()
+
+        if self.job_id:
+            await self._db.finish_job(self.job_id)
+
+async def resume_all(client: discord.Client) -> None:
+    """Resumes every mass action that was interrupted."""
+    async def resume(job: dict):
+        if (guild := client.get_guild(job['guild_id'])) is None:
+            return await database.Guild(discord.Object(job['guild_id'])).finish_job(job['_id'])
+
+        message = None
+
+        if channel := guild.get_channel(job.get('channel_id')):
+            try:
+                message = await channel.fetch_message(job['message_id'])
+            except discord.HTTPException:
+                pass
+
+        await MassAction(
+            guild,
+            job['action'],
+            job['user_ids'],
+            role = guild.get_role(job.get('role_id')),
+            message = message,
+            job_id = job['_id'],
+            done = job['done']
+        ).run()
+
+    await asyncio.gather(*map(resume, await database.jobs()))
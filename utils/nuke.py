@@ -0,0 +1,60 @@
+from utils.config import config
+
+from collections import deque
+from typing import Union
+import time
+
+class NukeDetector:
+    """Counts deletions per (guild, user, kind) over a sliding window, in memory.
+
+    Each key keeps a deque of its deletions inside the window, so expired ones are
+    dropped from the front and checking for a trip is just a length check.
+    """
+    def __init__(self, thresholds: dict[str, int], window: float):
+        self.thresholds = thresholds
+        self.window = window
+
+        self._windows: dict[tuple[int, int, str], deque[tuple[float, str]]] = {}
+        self._recorded = 0
+
+    def record(self, guild_id: int, user_id: int, kind: str, name: str) -> Union[list[str], None]:
+        """Records a deletion, returning the names of everything deleted in the window if it trips."""
+        now = time.monotonic()
+        key = (guild_id, user_id, kind)
+        window = self._windows.setdefault(key, deque())
+
+        while window and window[0][0] <= now - self.window:
+            window.popleft()
+
+        window.append((now, name))
+
+        # every so often, drop the windows of users that stopped deleting things
+        self._recorded += 1
+
+        if self._recorded % 256 == 0:
+            self._sweep(now)
+
+        if len(window) >= self.thresholds[kind]:
+            # start over, so the same deletions don't count towards another incident
+            del self._windows[key]
+            return [deleted for _, deleted in window]
+
+    def _sweep(self, now: float) -> None:
+        for key, window in list(self._windows.items()):
+            if window[-1][0] <= now - self.window:
+                del self._windows[key]
+
+    def forget(self, guild_id: int) -> None:
+        """Drops every window for a guild."""
+        for key in [key for key in self._windows if key[0] == guild_id]:
+            del self._windows[key]
+
+_threshold = config.getint("nuke", "threshold", fallback = 4)
+
+detector = NukeDetector(
+    thresholds = {
+        kind: config.getint("nuke", f"{kind}_threshold", fallback = _threshold)
+        for kind in ("role", "channel")
+    },
+    window = config.getfloat("nuke", "window", fallback = 300)
+)
@@ -0,0 +1,46 @@
+import discord
+
+# what the quarantined member themselves can do in their channel
+_MEMBER_OVERWRITE = discord.PermissionOverwrite(
+    view_channel = True,
+    attach_files = False,
+    use_external_emojis = False
+)
+
+class OverwriteTemplates:
+    """Caches the permission overwrites that every quarantine channel in a guild starts with.
+
+    A template only depends on the guild's allowed roles, so it's made once and
+    dropped (see forget) whenever roles are deleted/updated or t!allow is used.
+    """
+    def __init__(self):
+        self._templates: dict[int, dict[discord.abc.Snowflake, discord.PermissionOverwrite]] = {}
+
+    def template(self, guild: discord.Guild, allowed: list[int]) -> dict[discord.abc.Snowflake, discord.PermissionOverwrite]:
+        """Returns the overwrites shared by the guild's quarantine channels."""
+        if (template := self._templates.get(guild.id)) is not None:
+            return template
+
+        # allow only the bot (and allowed roles) to view the channel
+        template = {
+            guild.default_role: discord.PermissionOverwrite(read_messages = False),
+            guild.me: discord.PermissionOverwrite(view_channel = True)
+        }
+
+        # (roles that were deleted are skipped)
+        for role_id in allowed:
+            if role := guild.get_role(role_id):
+                template[role] = discord.PermissionOverwrite(view_channel = True)
+
+        self._templates[guild.id] = template
+        return template
+
+    def channel(self, member: discord.Member, allowed: list[int]) -> dict[discord.abc.Snowflake, discord.PermissionOverwrite]:
+        """Returns the overwrites for a member's quarantine channel."""
+        return {**self.template(member.guild, allowed), member: _MEMBER_OVERWRITE}
+
+    def forget(self, guild_id: int) -> None:
+        """Drops a guild's template (it's made again the next time it's needed)."""
+        self._templates.pop(guild_id, None)
+
+overwrite_templates = OverwriteTemplates()
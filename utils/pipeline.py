@@ -0,0 +1,144 @@
+from collections import deque
+from typing import Awaitable, Callable
+import asyncio
+import logging
+import time
+
+log = logging.getLogger("discord")
+
+class JoinPipeline:
+    """Queues member joins per guild and hands them to a handler in small batches.
+
+    Each guild gets its own queue, drained by up to `workers` tasks that wait up to
+    `batch_wait` seconds to collect `batch_size` joins before calling the handler.
+    Work started with run_all() (or given the semaphore property) shares one semaphore,
+    so at most `concurrency` actions (kicks, bans, quarantines) run at once across every guild.
+    """
+    def __init__(
+        self,
+        handler: Callable[[list], Awaitable[None]],
+        batch_size: int = 50,
+        batch_wait: float = 0.5,
+        workers: int = 2,
+        concurrency: int = 5
+    ):
+        self.handler = handler
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.workers = workers
+
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._queues: dict[int, asyncio.Queue] = {}
+        self._tasks: dict[int, set[asyncio.Task]] = {}
+
+        # seconds between a join being queued and its batch being handled (most recent joins only)
+        self.latencies = deque(maxlen = 1000)
+        self.handled = 0
+
+    def put(self, member) -> None:
+        """Queues a member that just joined."""
+        guild_id = member.guild.id
+
+        if guild_id not in self._queues:
+            self._queues[guild_id] = asyncio.Queue()
+            self._tasks[guild_id] = set()
+
+        self._queues[guild_id].put_nowait((time.perf_counter(), member))
+
+        # start another worker if the guild doesn't have enough yet (workers stop once the queue is empty)
+        tasks = self._tasks[guild_id]
+
+        if len(tasks) < self.workers:
+            tasks.add(asyncio.create_task(self._work(guild_id)))
+
+    def depth(self, guild_id: int = None) -> int:
+        """Returns how many joins are waiting (for one guild, or every guild)."""
+        if guild_id is not None:
+            queue = self._queues.get(guild_id)
+            return queue.qsize() if queue else 0
+
+        return sum(queue.qsize() for queue in self._queues.values())
+
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        """The semaphore that bounds every action (for work that isn't started with run_all)."""
+        return self._semaphore
+
+    def stats(self) -> dict:
+        """Returns the queue depth and the p50/p99 join latency (in seconds)."""
+        latencies = sorted(self.latencies)
+
+        def percentile(p: float):
+            return latencies[min(len(latencies) - 1, int(len(latencies) * p))] if latencies else None
+
+        return {
+            'depth': self.depth(),
+            'handled': self.handled,
+            'p50': percentile(0.5),
+            'p99': percentile(0.99)
+        }
+
+    async def run_all(self, coros: list[Awaitable]) -> list:
+        """Runs actions with bounded concurrency, logging (and returning) any that fail."""
+        async def run(coro):
+            async with self._semaphore:
+                return await coro
+
+        results = await asyncio.gather(*map(run, coros), return_exceptions = True)
+
+        for result in results:
+            if isinstance(result, Exception):
+                log.error("join action failed", exc_info = result)
+
+        return results
+
+    async def _next_batch(self, queue: asyncio.Queue) -> list:
+        """Waits for a batch of joins (returns an empty list once the queue stays empty)."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.batch_wait
+        batch = []
+
+        while len(batch) < self.batch_size:
+            if not queue.empty():
+                batch.append(queue.get_nowait())
+                continue
+
+            timeout = deadline - loop.time()
+
+            if timeout <= 0:
+                break
+
+            try:
+                batch.append(await asyncio.wait_for(queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+
+        return batch
+
+    async def _work(self, guild_id: int) -> None:
+        queue = self._queues[guild_id]
+        tasks = self._tasks[guild_id]
+
+        try:
+            while batch := await self._next_batch(queue):
+                try:
+                    await self.handler([member for _, member in batch])
+                except Exception:
+                    log.exception(f"couldn't handle {len(batch)} join(s) in {guild_id}")
+                finally:
+                    now = time.perf_counter()
+
+                    self.latencies.extend(now - queued_at for queued_at, _ in batch)
+                    self.handled += len(batch)
+        finally:
+            # (done here instead of in a callback so that put() never counts a worker that's stopping)
+            tasks.discard(asyncio.current_task())
+
+    def close(self) -> None:
+        """Stops every worker (anything still queued is dropped)."""
+        for tasks in self._tasks.values():
+            for task in tasks:
+                task.cancel()
+
+        self._queues.clear()
+        self._tasks.clear()
@@ -0,0 +1,121 @@
+import discord
+
+from utils.config import config
+from utils.assets import asset_store
+from utils.mass import retry
+
+from typing import Union
+import aiohttp
+import asyncio
+import io
+
+_CDN = "https://cdn.discordapp.com/"
+
+_DOWNLOADS = config.getint("restore", "downloads", fallback = 8)
+
+# (emoji/sticker uploads share a small per-guild rate limit, so doing more at once only gets them rate limited)
+_UPLOADS = config.getint("restore", "uploads", fallback = 1)
+
+# discord's upload size limits
+_MAX_SIZE = {'emoji': 256 * 1024, 'sticker': 512 * 1024}
+
+def image_format(data: bytes) -> Union[str, None]:
+    """Finds the format of an image from its first bytes."""
+    if data.startswith(b'\x89PNG'):
+        return 'png'  # (this includes animated pngs)
+    if data.startswith(b'GIF8'):
+        return 'gif'
+    if data.startswith(b'\xff\xd8'):
+        return 'jpeg'
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'webp'
+    if data[:1] == b'{':
+        return 'json'  # (lottie stickers)
+
+async def download(session: aiohttp.ClientSession, kind: str, item_id: int) -> tuple[bytes, str]:
+    """Downloads a cached emoji/sticker, returning its data and format."""
+    # emojis are sent in the format they were uploaded in, stickers have to be asked for in the right one
+    paths = [f"emojis/{item_id}"] if kind == 'emoji' else [f"stickers/{item_id}.{ext}" for ext in ('png', 'gif', 'json')]
+
+    for path in paths:
+        async with session.get(_CDN + path) as res:
+            if res.status == 200:
+                data = await res.read()
+                return data, image_format(data)
+
+    raise LookupError("it's not on discord's cdn anymore")
+
+async def restore(
+    kind: str,
+    guild: discord.Guild,
+    session: aiohttp.ClientSession,
+    entries: list[list]
+) -> tuple[list[tuple[list, Union[discord.Emoji, discord.GuildSticker]]], list[tuple[list, str]]]:
+    """Re-uploads cached emojis/stickers ([id, name] entries).
+
+    Images saved in the asset store are used first, the rest are downloaded at the same
+    time (through the given session) while uploads wait their turn. Returns the entries that were restored (with what was made from them)
+    and the ones that weren't (with the reason why).
+    """
+    download_limit = asyncio.Semaphore(_DOWNLOADS)
+    upload_limit = asyncio.Semaphore(_UPLOADS)
+
+    # free slots for each type (taken before uploading, so that nothing is uploaded into a full server)
+    if kind == 'emoji':
+        animated = sum(emoji.animated for emoji in guild.emojis)
+        free = {True: guild.emoji_limit - animated, False: guild.emoji_limit - (len(guild.emojis) - animated)}
+    else:
+        free = {False: guild.sticker_limit - len(guild.stickers)}
+
+    restored = []
+    failed = []
+
+    async def restore_one(entry: list):
+        item_id, name = entry[:2]
+
+        if (data := asset_store.read(kind, item_id)) is not None:
+            image = image_format(data)
+        else:
+            try:
+                async with download_limit:
+                    data, image = await download(session, kind, item_id)
+            except (LookupError, aiohttp.ClientError, asyncio.TimeoutError) as error:
+                return failed.append((entry, str(error) or "couldn't download it"))
+
+            # (so that it doesn't have to be downloaded again if uploading fails)
+            asset_store.put(kind, item_id, data)
+
+        if image is None:
+            return failed.append((entry, "unknown image format"))
+
+        if len(data) > _MAX_SIZE[kind]:
+            return failed.append((entry, f"too big ({len(data) // 1024} KB)"))
+
+        is_animated = kind == 'emoji' and image == 'gif'
+
+        if free[is_animated] <= 0:
+            return failed.append((entry, f"no {'animated ' if is_animated else ''}{kind} slots left"))
+
+        free[is_animated] -= 1
+
+        try:
+            async with upload_limit:
+                if kind == 'emoji':
+                    created = await retry(lambda: guild.create_custom_emoji(name = name, image = data))
+                else:
+                    # (a new file is made for every attempt, since uploading one reads it)
+                    created = await retry(lambda: guild.create_sticker(
+                        name = name,
+                        description = "",
+                        emoji = name,
+                        file = discord.File(io.BytesIO(data), f"{name}.{image}")
+                    ))
+        except discord.HTTPException as error:
+            free[is_animated] += 1
+            return failed.append((entry, error.text or f"discord error {error.status}"))
+
+        restored.append((entry, created))
+
+    await asyncio.gather(*[restore_one(entry) for entry in entries])
+
+    return restored, failed
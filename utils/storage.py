@@ -0,0 +1,489 @@
+import motor.motor_asyncio
+from bson import ObjectId
+from pymongo import DeleteMany, DeleteOne, InsertOne, ReplaceOne, ReturnDocument, UpdateMany, UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+from abc import ABC, abstractmethod
+from collections import Counter
+from types import SimpleNamespace
+import copy
+
+# used to tell "missing" apart from None when reading paths
+_MISSING = object()
+
+def apply_update(document: dict, update: dict) -> dict:
+    """Returns a copy of a document with mongo update operators applied to it.
+
+    Only the dicts/lists along the updated paths are copied, so documents that were
+    handed out earlier are never changed in place.
+    """
+    document = dict(document)
+
+    for operator, fields in update.items():
+        for path, value in fields.items():
+            *parents, key = path.split('.')
+            target = document
+
+            for part in parents:
+                child = target.get(part)
+
+                if child is None:
+                    if operator in ('$unset', '$pull'):
+                        break  # nothing to remove
+
+                    child = {}
+                elif not isinstance(child, dict):
+                    raise ValueError(f"can't apply {operator} to '{path}'")
+
+                target[part] = target = dict(child)
+            else:
+                if operator == '$set':
+                    target[key] = value
+
+                elif operator == '$unset':
+                    target.pop(key, None)
+
+                elif operator == '$inc':
+                    target[key] = target.get(key, 0) + value
+
+                elif operator == '$push':
+                    items = value['$each'] if isinstance(value, dict) and '$each' in value else [value]
+                    target[key] = list(target.get(key) or []) + list(items)
+
+                    # $slice keeps the first n items (or the last n if it's negative)
+                    if isinstance(value, dict) and (size := value.get('$slice')) is not None:
+                        target[key] = target[key][:size] if size >= 0 else target[key][size:]
+
+                elif operator == '$pull':
+                    if isinstance(current := target.get(key), list):
+                        if isinstance(value, dict) and '$in' in value:
+                            target[key] = [item for item in current if item not in value['$in']]
+                        else:
+                            target[key] = [item for item in current if item != value]
+
+                else:
+                    raise ValueError(f"unsupported update operator {operator}")
+
+    return document
+
+def _get_path(document: dict, path: str):
+    """Reads a dotted path from a document (_MISSING if it doesn't exist)."""
+    for part in path.split('.'):
+        if not isinstance(document, dict) or part not in document:
+            return _MISSING
+
+        document = document[part]
+
+    return document
+
+def _compare(value, condition) -> bool:
+    """Checks a single value against a query condition (a value or a dict of operators)."""
+    if not (isinstance(condition, dict) and condition and all(key.startswith('$') for key in condition)):
+        # arrays match if they contain the value (like mongo)
+        if isinstance(value, list) and not isinstance(condition, list):
+            return condition in value
+
+        return value is not _MISSING and value == condition
+
+    for operator, argument in condition.items():
+        present = value is not _MISSING
+
+        if operator == '$exists':
+            matched = present == bool(argument)
+        elif operator == '$eq':
+            matched = _compare(value, argument)
+        elif operator == '$ne':
+            matched = not _compare(value, argument)
+        elif operator == '$in':
+            matched = any(_compare(value, item) for item in argument)
+        elif operator == '$nin':
+            matched = not any(_compare(value, item) for item in argument)
+        elif operator == '$not':
+            matched = not _compare(value, argument)
+        elif operator in ('$lt', '$lte', '$gt', '$gte'):
+            try:
+                matched = present and {
+                    '$lt': value < argument,
+                    '$lte': value <= argument,
+                    '$gt': value > argument,
+                    '$gte': value >= argument
+                }[operator]
+            except TypeError:
+                matched = False
+        else:
+            raise ValueError(f"unsupported query operator {operator}")
+
+        if not matched:
+            return False
+
+    return True
+
+def _evaluate(document: dict, expression):
+    """Evaluates a (small subset of an) aggregation expression, as used by $expr."""
+    if isinstance(expression, str) and expression.startswith('$'):
+        value = _get_path(document, expression[1:])
+        return None if value is _MISSING else value
+
+    if not isinstance(expression, dict):
+        return expression
+
+    (operator, arguments), = expression.items()
+    values = [_evaluate(document, argument) for argument in arguments]
+
+    if operator == '$ifNull':
+        return next((value for value in values if value is not None), None)
+
+    if operator in ('$eq', '$ne', '$lt', '$lte', '$gt', '$gte'):
+        left, right = values
+
+        try:
+            return {
+                '$eq': lambda: left == right,
+                '$ne': lambda: left != right,
+                '$lt': lambda: left < right,
+                '$lte': lambda: left <= right,
+                '$gt': lambda: left > right,
+                '$gte': lambda: left >= right
+            }[operator]()
+        except TypeError:
+            return False
+
+    raise ValueError(f"unsupported expression operator {operator}")
+
+def matches(document: dict, query: dict) -> bool:
+    """Checks if a document matches a mongo query."""
+    for key, condition in query.items():
+        if key == '$expr':
+            if not _evaluate(document, condition):
+                return False
+        elif key == '$or':
+            if not any(matches(document, sub) for sub in condition):
+                return False
+        elif key == '$and':
+            if not all(matches(document, sub) for sub in condition):
+                return False
+        elif not _compare(_get_path(document, key), condition):
+            return False
+
+    return True
+
+def _project(document: dict, projection: dict = None) -> dict:
+    """Returns a copy of a document with a mongo projection applied to it."""
+    document = copy.deepcopy(document)
+
+    if not projection:
+        return document
+
+    if any(value for key, value in projection.items() if key != '_id'):
+        keep = {key for key, value in projection.items() if value}
+
+        if projection.get('_id', 1):
+            keep.add('_id')
+
+        return {key: value for key, value in document.items() if key in keep}
+
+    return {key: value for key, value in document.items() if projection.get(key, 1)}
+
+def _sort_key(sort: list[tuple[str, int]]):
+    """Makes a key function for sorting documents like mongo (missing values first)."""
+    def key(document: dict):
+        values = []
+
+        for field, direction in sort:
+            value = _get_path(document, field)
+            values.append((0, 0) if value is _MISSING else (1, value))
+
+        return values
+
+    return key
+
+class MemoryCursor:
+    """A (very small) version of motor's cursor for in-memory collections."""
+    def __init__(self, documents: list[dict], projection: dict = None):
+        self._documents = documents
+        self._projection = projection
+        self._skip = 0
+        self._limit = 0
+
+    def sort(self, key, direction: int = 1):
+        sort = key if isinstance(key, list) else [(key, direction)]
+
+        # sort by the last key first so that earlier keys take priority
+        for field, field_direction in reversed(sort):
+            self._documents.sort(key = _sort_key([(field, field_direction)]), reverse = field_direction < 0)
+
+        return self
+
+    def skip(self, amount: int):
+        self._skip = amount
+        return self
+
+    def limit(self, amount: int):
+        self._limit = amount
+        return self
+
+    def _results(self) -> list[dict]:
+        documents = self._documents[self._skip:]
+
+        if self._limit:
+            documents = documents[:self._limit]
+
+        return [_project(document, self._projection) for document in documents]
+
+    async def to_list(self, length: int = None) -> list[dict]:
+        results = self._results()
+        return results if length is None else results[:length]
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for document in self._results():
+            yield document
+
+class MemoryCollection:
+    """An in-memory collection that supports the parts of motor's API the bot uses.
+
+    None of the methods await anything, so each of them runs atomically.
+    """
+    def __init__(self, name: str):
+        self.name = name
+        self._documents: list[dict] = []
+        self._unique: list[tuple[str, ...]] = []
+
+    def _find(self, query: dict, sort: list = None) -> list[dict]:
+        found = [document for document in self._documents if matches(document, query)]
+
+        if sort:
+            for field, direction in reversed(sort):
+                found.sort(key = _sort_key([(field, direction)]), reverse = direction < 0)
+
+        return found
+
+    def _check_unique(self, document: dict, ignore: dict = None) -> None:
+        for fields in self._unique:
+            values = [_get_path(document, field) for field in fields]
+
+            for other in self._documents:
+                if other is not ignore and [_get_path(other, field) for field in fields] == values:
+                    raise DuplicateKeyError(f"duplicate key for index {fields}: {values}")
+
+    def _insert(self, document: dict) -> dict:
+        document = {'_id': ObjectId(), **copy.deepcopy(document)}
+        self._check_unique(document)
+        self._documents.append(document)
+
+        return document
+
+    def _replace(self, old: dict, new: dict) -> None:
+        self._check_unique(new, ignore = old)
+        self._documents[self._documents.index(old)] = new
+
+    def _upsert(self, query: dict, update: dict) -> dict:
+        """Inserts a document made from a query's equality fields and an update."""
+        base = {
+            key: value for key, value in query.items()
+            if not key.startswith('$') and not (isinstance(value, dict) and any(k.startswith('$') for k in value))
+        }
+
+        document = {}
+
+        for key, value in base.items():
+            document = apply_update(document, {'$set': {key: value}})
+
+        update = dict(update)
+        update['$set'] = {**update.pop('$setOnInsert', {}), **update.get('$set', {})}
+
+        return self._insert(apply_update(document, copy.deepcopy(update)))
+
+    def _update(self, document: dict, update: dict) -> dict:
+        update = {operator: fields for operator, fields in update.items() if operator != '$setOnInsert'}
+        updated = apply_update(document, copy.deepcopy(update))
+        self._replace(document, updated)
+
+        return updated
+
+    async def find_one(self, query: dict = None, projection: dict = None, sort: list = None):
+        found = self._find(query or {}, sort)
+        return _project(found[0], projection) if found else None
+
+    def find(self, query: dict = None, projection: dict = None) -> MemoryCursor:
+        return MemoryCursor(self._find(query or {}), projection)
+
+    async def count_documents(self, query: dict, limit: int = 0) -> int:
+        count = len(self._find(query))
+        return min(count, limit) if limit else count
+
+    async def insert_one(self, document: dict):
+        return SimpleNamespace(inserted_id = self._insert(document)['_id'])
+
+    async def update_one(self, query: dict, update: dict, upsert: bool = False):
+        found = self._find(query)
+
+        if found:
+            self._update(found[0], update)
+            return SimpleNamespace(matched_count = 1, modified_count = 1, upserted_id = None)
+
+        if upsert:
+            return SimpleNamespace(matched_count = 0, modified_count = 0, upserted_id = self._upsert(query, update)['_id'])
+
+        return SimpleNamespace(matched_count = 0, modified_count = 0, upserted_id = None)
+
+    async def update_many(self, query: dict, update: dict, upsert: bool = False):
+        found = self._find(query)
+
+        for document in found:
+            self._update(document, update)
+
+        if not found and upsert:
+            return SimpleNamespace(matched_count = 0, modified_count = 0, upserted_id = self._upsert(query, update)['_id'])
+
+        return SimpleNamespace(matched_count = len(found), modified_count = len(found), upserted_id = None)
+
+    async def replace_one(self, query: dict, replacement: dict, upsert: bool = False):
+        found = self._find(query)
+
+        if found:
+            self._replace(found[0], {'_id': found[0]['_id'], **copy.deepcopy(replacement)})
+            return SimpleNamespace(matched_count = 1, modified_count = 1, upserted_id = None)
+
+        if upsert:
+            return SimpleNamespace(matched_count = 0, modified_count = 0, upserted_id = self._insert(replacement)['_id'])
+
+        return SimpleNamespace(matched_count = 0, modified_count = 0, upserted_id = None)
+
+    async def delete_one(self, query: dict):
+        found = self._find(query)
+
+        if found:
+            self._documents.remove(found[0])
+
+        return SimpleNamespace(deleted_count = len(found[:1]))
+
+    async def delete_many(self, query: dict):
+        found = self._find(query)
+        self._documents = [document for document in self._documents if not any(document is f for f in found)]
+
+        return SimpleNamespace(deleted_count = len(found))
+
+    async def find_one_and_update(
+        self,
+        query: dict,
+        update: dict,
+        projection: dict = None,
+        sort: list = None,
+        upsert: bool = False,
+        return_document: bool = ReturnDocument.BEFORE
+    ):
+        found = self._find(query, sort)
+
+        if found:
+            before = found[0]
+            after = self._update(before, update)
+        elif upsert:
+            before, after = None, self._upsert(query, update)
+        else:
+            return None
+
+        result = after if return_document == ReturnDocument.AFTER else before
+        return _project(result, projection) if result else None
+
+    async def find_one_and_delete(self, query: dict, projection: dict = None, sort: list = None):
+        found = self._find(query, sort)
+
+        if not found:
+            return None
+
+        self._documents.remove(found[0])
+        return _project(found[0], projection)
+
+    async def bulk_write(self, requests: list, ordered: bool = True):
+        # (pymongo's write models keep their arguments in private attributes)
+        for request in requests:
+            if isinstance(request, InsertOne):
+                await self.insert_one(request._doc)
+            elif isinstance(request, UpdateOne):
+                await self.update_one(request._filter, request._doc, upsert = bool(request._upsert))
+            elif isinstance(request, UpdateMany):
+                await self.update_many(request._filter, request._doc, upsert = bool(request._upsert))
+            elif isinstance(request, ReplaceOne):
+                await self.replace_one(request._filter, request._doc, upsert = bool(request._upsert))
+            elif isinstance(request, DeleteOne):
+                await self.delete_one(request._filter)
+            elif isinstance(request, DeleteMany):
+                await self.delete_many(request._filter)
+            else:
+                raise ValueError(f"unsupported write {request!r}")
+
+        return SimpleNamespace(acknowledged = True)
+
+    async def create_index(self, keys, unique: bool = False, **kwargs) -> str:
+        fields = (keys,) if isinstance(keys, str) else tuple(field for field, _ in keys)
+
+        if unique and fields not in self._unique:
+            self._unique.append(fields)
+
+        return '_'.join(fields)
+
+class _Counted:
+    """Wraps a collection, counting how many times each of its methods is called."""
+    def __init__(self, collection, counts: Counter):
+        self._collection = collection
+        self._counts = counts
+
+    def __getattr__(self, name: str):
+        attr = getattr(self._collection, name)
+
+        if name.startswith('_') or not callable(attr):
+            return attr
+
+        def counted(*args, **kwargs):
+            self._counts[name] += 1
+            return attr(*args, **kwargs)
+
+        return counted
+
+class Backend(ABC):
+    """Where guild data is stored.
+
+    Every collection handed out is wrapped so that calls to it are counted in
+    self.counts (operation name -> number of calls, one per round trip).
+    """
+    def __init__(self):
+        self.counts = Counter()
+
+    def collection(self, name: str):
+        """Returns a collection (with motor's interface) by name."""
+        return _Counted(self._collection(name), self.counts)
+
+    @abstractmethod
+    def _collection(self, name: str):
+        """Returns the backend's own collection by name (wrapped by collection())."""
+
+    def close(self) -> None:
+        """Closes any connections the backend has open."""
+
+class MongoBackend(Backend):
+    """Stores everything in mongodb (using motor)."""
+    def __init__(self, uri: str, database: str, **options):
+        super().__init__()
+        self.client = motor.motor_asyncio.AsyncIOMotorClient(uri, **options)
+        self.database = self.client[database]
+
+    def _collection(self, name: str):
+        return self.database[name]
+
+    def close(self) -> None:
+        self.client.close()
+
+class MemoryBackend(Backend):
+    """Stores everything in memory (for testing/benchmarking without a database)."""
+    def __init__(self):
+        super().__init__()
+        self.collections: dict[str, MemoryCollection] = {}
+
+    def _collection(self, name: str):
+        if name not in self.collections:
+            self.collections[name] = MemoryCollection(name)
+
+        return self.collections[name]
@@ -0,0 +1,257 @@
+import discord
+
+from utils.config import config
+
+from tempfile import SpooledTemporaryFile
+from datetime import datetime
+from pathlib import Path
+from typing import Union
+import asyncio
+import gzip
+import json
+import io
+import time
+
+# transcripts are kept in memory until they get this big, then moved to disk
+_SPOOL_SIZE = 1024 * 1024
+
+# space left at the end of each part (gzip holds on to some data until it's closed)
+_MARGIN = 64 * 1024
+
+def format_line(date: datetime, author: str, content: str, attachments: list = ()) -> str:
+    """Formats a line of a transcript."""
+    content = (content.replace('\n', ' ').replace('  ', ' ') + ' ') if content else ''
+    return f"[{date.strftime('%m/%d/%Y %H:%M:%S')}] {author} > {content}" + ' '.join(map(str, attachments)) + '\n'
+
+def format_message(message: discord.Message) -> str:
+    """Formats a message as a line of a transcript."""
+    return format_line(message.created_at, str(message.author), message.content, message.attachments)
+
+class Transcript:
+    """Streams lines into (optionally gzipped) spooled temporary files.
+
+    A new part is started whenever the current one would get too big to upload,
+    so a transcript can be sent as several files instead of failing.
+    """
+    def __init__(self, name: str, max_size: int, compress: bool = False):
+        self.name = name
+        self.max_size = max(max_size - _MARGIN, _MARGIN)
+        self.compress = compress
+
+        self.parts: list[SpooledTemporaryFile] = []
+        self.messages = 0
+        self.bytes = 0  # (before compression)
+
+        self._file: Union[SpooledTemporaryFile, None] = None
+        self._writer: Union[io.IOBase, None] = None
+        self._part_bytes = 0
+        self._started = time.perf_counter()
+
+    def _finish_part(self) -> None:
+        # (closing the gzip writer leaves the file itself open)
+        if self.compress and self._writer is not None:
+            self._writer.close()
+
+        self._file = self._writer = None
+
+    def _new_part(self) -> None:
+        self._finish_part()
+
+        self._file = SpooledTemporaryFile(max_size = _SPOOL_SIZE)
+        self._writer = gzip.GzipFile(fileobj = self._file, mode = 'wb') if self.compress else self._file
+        self._part_bytes = 0
+
+        self.parts.append(self._file)
+
+    def write(self, line: str) -> None:
+        """Adds a line to the transcript."""
+        data = line.encode("utf8")
+
+        if self._file is None or (self._part_bytes and self._file.tell() + len(data) > self.max_size):
+            self._new_part()
+
+        self._writer.write(data)
+        self._part_bytes += len(data)
+
+        self.messages += 1
+        self.bytes += len(data)
+
+    def add(self, message: discord.Message) -> None:
+        """Adds a message to the transcript."""
+        self.write(format_message(message))
+
+    @property
+    def elapsed(self) -> float:
+        return time.perf_counter() - self._started
+
+    @property
+    def summary(self) -> str:
+        size = f"{self.bytes / 1024:.1f} KB" if self.bytes < 1024 * 1024 else f"{self.bytes / 1024 / 1024:.1f} MB"
+        return f"{self.messages} messages, {size}, took {self.elapsed:.1f}s"
+
+    def files(self) -> list[discord.File]:
+        """Finishes the transcript and returns its parts as files to upload."""
+        self._finish_part()
+
+        extension = ".txt.gz" if self.compress else ".txt"
+        files = []
+
+        for number, part in enumerate(self.parts, 1):
+            part.seek(0)
+            suffix = f"_part{number}" if len(self.parts) > 1 else ""
+
+            # (SpooledTemporaryFile is only an IOBase itself on python 3.11+)
+            fp = part if isinstance(part, io.IOBase) else part._file
+            files.append(discord.File(fp, filename = f"{self.name}{suffix}{extension}"))
+
+        return files
+
+    def close(self) -> None:
+        """Deletes the transcript's temporary files."""
+        self._finish_part()
+
+        for part in self.parts:
+            part.close()
+
+        self.parts.clear()
+
+class ChannelLogs:
+    """Append-only logs of quarantine channels, written to as messages are sent/edited/deleted.
+
+    Each tracked channel has a file of json lines ({"id": message id, "line": ...}) in
+    the directory, so ending a quarantine only needs to fetch the messages that were
+    sent while the bot wasn't watching (see backfill).
+    """
+    def __init__(self, directory: str):
+        self.directory = Path(directory)
+
+        # channel id -> id of the newest message seen in it
+        self._last_seen: dict[int, int] = {}
+        self._locks: dict[int, asyncio.Lock] = {}
+
+        # messages sent while a channel is being backfilled (logged once it's done, to keep the order)
+        self._pending: dict[int, list[discord.Message]] = {}
+
+    def _path(self, channel_id: int) -> Path:
+        return self.directory / f"{channel_id}.jsonl"
+
+    def tracking(self, channel_id: int) -> bool:
+        return channel_id in self._last_seen
+
+    def track(self, channel_id: int) -> None:
+        """Starts logging a channel (picking up where its log left off, if it has one)."""
+        if self.tracking(channel_id):
+            return
+
+        self.directory.mkdir(parents = True, exist_ok = True)
+
+        # (message ids are bigger than the id of the channel they're in)
+        last_seen = channel_id
+
+        if (path := self._path(channel_id)).exists():
+            with path.open(encoding = "utf8") as log:
+                for entry in map(json.loads, log):
+                    if entry.get('kind') == 'message':
+                        last_seen = max(last_seen, entry['id'])
+
+        self._last_seen[channel_id] = last_seen
+        self._locks[channel_id] = asyncio.Lock()
+
+    def untrack(self, channel_id: int) -> None:
+        """Stops logging a channel and deletes its log."""
+        self._last_seen.pop(channel_id, None)
+        self._locks.pop(channel_id, None)
+        self._path(channel_id).unlink(missing_ok = True)
+
+    def _append(self, channel_id: int, entry: dict) -> None:
+        with self._path(channel_id).open("a", encoding = "utf8") as log:
+            log.write(json.dumps(entry) + "\n")
+
+    def add_message(self, message: discord.Message) -> None:
+        """Logs a new message (messages by the bot itself are skipped)."""
+        if (pending := self._pending.get(message.channel.id)) is not None:
+            pending.append(message)
+        else:
+            self._log(message)
+
+    def _log(self, message: discord.Message) -> None:
+        channel_id = message.channel.id
+
+        # skip anything that was already logged (by a backfill)
+        if not self.tracking(channel_id) or message.id <= self._last_seen[channel_id]:
+            return
+
+        self._last_seen[channel_id] = message.id
+
+        if message.author != message.guild.me:
+            self._append(channel_id, {'kind': 'message', 'id': message.id, 'line': format_message(message)})
+
+    def add_edit(self, payload: discord.RawMessageUpdateEvent) -> None:
+        """Logs a message's new content."""
+        if not self.tracking(payload.channel_id) or 'content' not in payload.data:
+            return  # (edits without content are usually embeds loading)
+
+        if payload.cached_message:
+            author = payload.cached_message.author
+
+            if author == author.guild.me or payload.cached_message.content == payload.data['content']:
+                return
+
+            author = str(author)
+        else:
+            author = payload.data.get('author', {}).get('username', 'unknown')
+
+        line = format_line(discord.utils.utcnow(), f"{author} (edited)", payload.data['content'])
+        self._append(payload.channel_id, {'kind': 'edit', 'id': payload.message_id, 'line': line})
+
+    def add_delete(self, payload: discord.RawMessageDeleteEvent) -> None:
+        """Logs that a message was deleted."""
+        if not self.tracking(payload.channel_id):
+            return
+
+        if message := payload.cached_message:
+            if message.author == message.guild.me:
+                return
+
+            line = format_line(discord.utils.utcnow(), f"{message.author} (deleted)", message.content, message.attachments)
+        else:
+            line = format_line(discord.utils.utcnow(), "(deleted)", f"message {payload.message_id}")
+
+        self._append(payload.channel_id, {'kind': 'delete', 'id': payload.message_id, 'line': line})
+
+    async def backfill(self, channel: discord.TextChannel) -> int:
+        """Logs messages that were sent since the channel was last seen (returns how many were fetched)."""
+        self.track(channel.id)
+        fetched = 0
+
+        async with self._locks[channel.id]:
+            after = discord.Object(self._last_seen[channel.id])
+            self._pending[channel.id] = []
+
+            try:
+                async for message in channel.history(limit = None, after = after, oldest_first = True):
+                    self._log(message)
+                    fetched += 1
+            finally:
+                for message in self._pending.pop(channel.id):
+                    self._log(message)
+
+        return fetched
+
+    def transcript(self, channel_id: int, name: str, max_size: int, compress: bool = False) -> Transcript:
+        """Streams a channel's log into a transcript."""
+        transcript = Transcript(name, max_size, compress)
+
+        if (path := self._path(channel_id)).exists():
+            with path.open(encoding = "utf8") as log:
+                for entry in map(json.loads, log):
+                    transcript.write(entry['line'])
+
+        return transcript
+
+    @property
+    def channels(self) -> list[int]:
+        """The ids of every channel being logged."""
+        return list(self._last_seen)
+
+channel_logs = ChannelLogs(config.get("transcripts", "directory", fallback = "transcripts"))
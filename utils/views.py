@@ -2,47 +2,42 @@ import discord
 from discord.ext import commands
 
 from utils.base import BaseEmbed
+from utils.restore import restore
 from utils import database
 from cogs import automod
 
-import aiohttp
-import io
+from typing import Any, Callable
+import math
 
 async def refresh(view: discord.ui.View, kind, original, removed, orig_msg: discord.Message, ctx: commands.Context):
     """Refreshes the list of emojis/stickers in a message."""
     # use a list of all the emojis/stickers that weren't deleted as the new cache
     new_cache = [item for item in original if item not in removed]
-    embed, view = await automod.e_or_s_list(ctx, orig_msg, kind, new_cache)
+    embed, view = await automod.e_or_s_list(ctx, orig_msg, kind, new_cache, view.page)
 
     await orig_msg.edit(embed = embed, view = view)
 
 async def create(kind, interaction: discord.Interaction, db: database.Guild, chosen_list):
-    """Uploads cached emojis/stickers."""
+    """Uploads cached emojis/stickers (returns the ones that were restored and the ones that weren't)."""
+    # (uses the bot's session instead of making one per image)
+    restored, failed = await restore(kind, interaction.guild, interaction.client.session, chosen_list)
 
-    async def to_bytes(id):
-        """Converts the url of an emoji/sticker into bytes."""
-        url = 'https://cdn.discordapp.com/' + (f'emojis/{id}' if kind == 'emoji' else f'stickers/{id}.png')
+    # remove only the emojis that were added from cache
+    if restored:
+        await db.pull_from_list(f'{kind}_cache', {'$in': [entry for entry, _ in restored]})
 
-        # return the image in bytes
-        async with aiohttp.ClientSession() as aio:
-            async with aio.get(url) as res:
-                return await res.read()
+    return restored, failed
 
-    created = []
+def result_embed(kind, interaction: discord.Interaction, restored, failed):
+    """Generates the embed showing what was (and wasn't) restored."""
+    embed = discord.Embed(color = discord.Color.brand_green() if restored else discord.Color.red())
+    embed.set_author(name = f'Added {len(restored)} {kind}(s)', icon_url = interaction.user.display_avatar)
 
-    if kind == 'emoji':
-        for emoji in chosen_list:
-            created.append(await interaction.guild.create_custom_emoji(name = emoji[1], image = await to_bytes(emoji[0])))
+    if failed:
+        # list what couldn't be added and why
+        embed.description = "**Couldn't add:**\n" + "\n".join(f"- {entry[1]} ({reason})" for entry, reason in failed)
 
-    elif kind == 'sticker':
-        for sticker in chosen_list:
-            file = discord.File(io.BytesIO(await to_bytes(sticker[0]), f'{sticker[1]}.png'))
-            created.append(await interaction.guild.create_sticker(name = sticker[1], file = file))
-
-    # remove all added emojis from cache
-    await db.pull_from_list(f'{kind}_cache', {'$in': chosen_list})
-
-    return created
+    return embed
 
 class HelpView(discord.ui.View):
     def __init__(self, ctx: commands.Context, msg: discord.Message = None):
@@ -67,6 +62,7 @@ class HelpView(discord.ui.View):
             `t!setup               ` - sets up the quarantine functionality of the bot
             `t!allow *[roles]      ` - allows specified roles to view quarantines
             `t!toggle *[method]    ` - changes the mode of the bot
+            `t!slots *[amount/mode]` - sets how many quarantines can be open (channels or threads)
             `t!lockdown            ` - applies the current method to anyone joining
             `t!priority *[channels]` - distinguishes important channels
             `t!quarantine | t!q    ` - shows information about current quarantines
@@ -84,13 +80,14 @@ class HelpView(discord.ui.View):
             `t!setup           ` - administrator
             `t!allow           ` - administrator
             `t!toggle          ` - manage roles, kick/ban
+            `t!slots           ` - administrator
             `t!lockdown        ` - manage roles, kick/ban
             `t!priority        ` - administrator
             `t!quarantine      ` - manage roles, kick/ban
             `t!sticker` | `t!emoji` - manage emojis/stickers
 
             **Required permissions (bot):**
-            manage emojis/roles/channels, kick/ban, view audit log, read message history
+            manage emojis/roles/channels/threads, kick/ban, view audit log, read message history
             """
             self.children[0].label = "commands"
 
@@ -103,12 +100,24 @@ class HelpView(discord.ui.View):
         await self.msg.edit(embed = embed, view = view)
 
 class EmojiView(discord.ui.View):
-    def __init__(self, msg, ctx, given_list, kind):
+    def __init__(self, msg, ctx, given_list, kind, shown = None, page = 0, pages = 1):
         super().__init__()
         self.list = given_list
+        self.shown = given_list if shown is None else shown  # (the entries on the current page)
         self.kind = kind
         self.ctx = ctx
         self.msg = msg
+        self.page = page
+
+        self.back.disabled = page == 0
+        self.next.disabled = page + 1 >= pages
+
+    async def turn(self, interaction: discord.Interaction, page: int):
+        if interaction.user != self.ctx.author:
+            return
+
+        embed, view = await automod.e_or_s_list(self.ctx, self.msg, self.kind, self.list, page)
+        await interaction.response.edit_message(embed = embed, view = view)
 
     @discord.ui.button(label = "add one", style = discord.ButtonStyle.gray)
     async def add_one(self, interaction: discord.Interaction, button: discord.ui.Button):
@@ -117,8 +126,8 @@ class EmojiView(discord.ui.View):
 
         db = database.Guild(interaction.guild)
 
-        # brings up a selection for the user to choose
-        view = SelectEmojiView(self.kind, db, self.list, self.ctx, self.msg, self, interaction)
+        # brings up a selection for the user to choose (from the current page, since selections hold 25 options)
+        view = SelectEmojiView(self.kind, db, self.shown, self.ctx, self.msg, self, interaction)
         await interaction.response.send_message(view = view, ephemeral = True)
 
     @discord.ui.button(label = "add all", style = discord.ButtonStyle.gray)
@@ -128,14 +137,22 @@ class EmojiView(discord.ui.View):
 
         db = database.Guild(interaction.guild)
 
+        # (uploading can take longer than discord waits for a response)
+        await interaction.response.defer()
+
         # uploads every cached emoji (self.list is the cache list)
-        await create(self.kind, interaction, db, self.list)
+        restored, failed = await create(self.kind, interaction, db, self.list)
 
-        embed = discord.Embed(color = discord.Color.brand_green())
-        embed.set_author(name = f'Added {len(self.list)} {self.kind}(s)', icon_url = interaction.user.display_avatar)
+        await interaction.followup.send(embed = result_embed(self.kind, interaction, restored, failed))
+        await refresh(self, self.kind, self.list, [entry for entry, _ in restored], self.msg, self.ctx)
+
+    @discord.ui.button(label = "<", style = discord.ButtonStyle.gray)
+    async def back(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await self.turn(interaction, self.page - 1)
 
-        await interaction.response.send_message(embed = embed)
-        await refresh(self, self.kind, self.list, self.list, self.msg, self.ctx)
+    @discord.ui.button(label = ">", style = discord.ButtonStyle.gray)
+    async def next(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await self.turn(interaction, self.page + 1)
 
 class SelectEmojiView(discord.ui.View):
     def __init__(self, kind, db, given_list, ctx, msg, orig_view, interaction):
@@ -154,25 +171,32 @@ class SelectEmojiView(discord.ui.View):
         self.children[0].options = [discord.SelectOption(label = item[1], value = f"{item[0]}:{item[1]}") for item in given_list]
 
     @discord.ui.select(placeholder = "Select the one you want to re-add")
-    async def callback(self, select: discord.ui.Select, interaction: discord.Interaction):
-        #turn string value back into [id, name]
-        emoji = select.values[0].split(':')
-        emoji[0] = int(emoji[0])
+    async def callback(self, interaction: discord.Interaction, select: discord.ui.Select):
+        # find the chosen entry using the id in its value
+        chosen_id = int(select.values[0].split(':', 1)[0])
+        emoji = next(item for item in self.list if item[0] == chosen_id)
+
+        await interaction.response.defer()
 
         # upload chosen emoji
-        e_or_s = await create(self.kind, interaction, self.db, [emoji])
+        restored, failed = await create(self.kind, interaction, self.db, [emoji])
+
+        if not restored:
+            return await self.orig_inter.followup.send(embed = result_embed(self.kind, interaction, restored, failed))
+
+        e_or_s = restored[0][1]
 
         # use colons around the name if it's an emoji
-        if isinstance(e_or_s[0], discord.Emoji):
-            result = f':{e_or_s[0].name}:'
+        if isinstance(e_or_s, discord.Emoji):
+            result = f':{e_or_s.name}:'
         else:
-            result = e_or_s[0].name
+            result = e_or_s.name
 
         embed = discord.Embed(color = discord.Color.brand_green())
         embed.set_author(name = f'Added {result}', icon_url = interaction.user.display_avatar)
 
         await self.orig_inter.followup.send(embed = embed)
-        await refresh(self.orig_view, self.kind, self.list, [emoji], self.msg, self.ctx)
+        await refresh(self.orig_view, self.kind, self.orig_view.list, [emoji], self.msg, self.ctx)
 
 class ConfirmView(discord.ui.View):
     def __init__(self, user: discord.Member, options: dict = {"yes": True, "no i don't care": False}):
@@ -315,16 +339,24 @@ class Paginator(discord.ui.View):
 
         self.update_btns()
 
+    @property
+    def page_count(self) -> int:
+        return len(self.pages)
+
+    def page(self, number: int) -> discord.Embed:
+        return self.pages[number]
+
     def update_btns(self):
         self.children[0].disabled = self.current == 0
-        self.children[1].label = f"{self.current + 1}/{len(self.pages)}"
-        self.children[2].disabled = (self.current + 1) == len(self.pages)
+        self.children[1].label = f"{self.current + 1}/{self.page_count}"
+        self.children[2].disabled = (self.current + 1) >= self.page_count
 
     async def update_page(self, interaction: discord.Interaction, next: bool = True):
         self.current = self.current + 1 if next else self.current - 1
+        self.current = max(0, min(self.current, self.page_count - 1))
         self.update_btns()
 
-        await interaction.response.edit_message(embed = self.pages[self.current], view = self)
+        await interaction.response.edit_message(embed = self.page(self.current), view = self)
 
     @discord.ui.button(label = "<", custom_id = "pg:back", disabled = True)
     async def back(self, interaction: discord.Interaction, button: discord.ui.Button):
@@ -336,4 +368,31 @@ class Paginator(discord.ui.View):
 
     @discord.ui.button(label = ">", custom_id = "pg:next")
     async def next(self, interaction: discord.Interaction, button: discord.ui.Button):
-        await self.update_page(interaction, True)
\ No newline at end of file
+        await self.update_page(interaction, True)
+
+class LazyPaginator(Paginator):
+    """A paginator that only makes a page when it's shown (for lists that can be long).
+
+    The source needs len() and page(start, amount), and is read again every time the
+    page changes, so it always shows what's in it right now.
+    """
+    def __init__(self, title: str, source, format: Callable[[Any], str] = str, per_page: int = 10):
+        discord.ui.View.__init__(self, timeout = None)
+
+        self.title = title
+        self.source = source
+        self.format = format
+        self.per_page = per_page
+        self.current = 0
+
+        self.update_btns()
+
+    @property
+    def page_count(self) -> int:
+        return max(1, math.ceil(len(self.source) / self.per_page))
+
+    def page(self, number: int) -> discord.Embed:
+        start = number * self.per_page
+        lines = [f"**{start + num + 1}.** {self.format(item)}" for num, item in enumerate(self.source.page(start, self.per_page))]
+
+        return BaseEmbed(description = "\n".join(lines) or "Nothing here anymore.").set_author(name = self.title)